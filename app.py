@@ -1,18 +1,100 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, stream_template, request, redirect, url_for, flash, get_flashed_messages, session, send_file, abort, g, Response
+from markupsafe import Markup
 import smtplib
 from email.mime.text import MIMEText
+import hmac
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-import threading
-import time
-from supabase_db import db
+import uuid
+from supabase_db import db, resolution_scope, in_resolution_scope, private_tempdir
+from scheduler import DeadlineScheduler
+from leader import LeaderElection
+from attachments import create_attachment_store
+import metrics
+import tracing
+from profiling import create_profiler
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Needed for flash messages
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 
+# Uploaded files are streamed to the attachment store; the fichier table only keeps metadata
+attachment_store = create_attachment_store()
+# Let a front proxy (nginx X-Accel/Apache X-Sendfile) serve attachment bodies
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+# Browser cache lifetime of downloaded attachments (content behind a file id never changes)
+ATTACHMENT_MAX_AGE = int(os.environ.get('ATTACHMENT_MAX_AGE', 3600))
+# Seconds between content losing its last fichier row and its deletion. Longer
+# than any upload request, so an upload deduplicated onto that content in the
+# meantime has written its own row when the content is checked again
+ATTACHMENT_DELETE_GRACE = float(os.environ.get('ATTACHMENT_DELETE_GRACE', 600))
+
+# ---- Instrumentation ----
+# Bearer token required to read /metrics; without one the endpoint is disabled
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Connection pool and cache counters of SupabaseDB, read at each scrape
+metrics.register_gauge(metrics.Gauge(
+    "digitickets_backend_pool", "Supabase connection pool and retry counters", ("stat",),
+    lambda: [((stat,), value) for _, stat, value in metrics.stats_samples(db.get_transport_stats())]))
+metrics.register_gauge(metrics.Gauge(
+    "digitickets_cache", "SupabaseDB cache entries and counters per backend", ("backend", "stat"),
+    lambda: [((backend, stat), value) for backend, stat, value in metrics.stats_samples(db.get_cache_stats())]))
+
+@app.before_request
+def start_request_metrics():
+    g.request_stats = metrics.begin_request()
+    tracing.begin_trace(request.endpoint or 'unmatched', method=request.method, path=request.path)
+
+@app.after_request
+def add_server_timing(response):
+    stats = g.pop('request_stats', None)
+    if stats is not None:
+        route = request.endpoint or 'unmatched'
+        if g.get('streamed_page'):
+            # A streamed page queries the backend after the headers are sent,
+            # so it is aggregated (without Server-Timing) once the body is done
+            method, status = request.method, response.status_code
+            response.call_on_close(lambda: metrics.finish_request(stats, route, method, status))
+        else:
+            response.headers['Server-Timing'] = metrics.finish_request(stats, route, request.method, response.status_code)
+    return response
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    metrics.end_request()
+    tracing.end_trace()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_TOKEN:
+        abort(404)
+    # Constant-time comparison, so response times do not leak the token
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+        abort(403)
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Sampled request profiles, when PROFILE_SAMPLE_RATE or PROFILE_SECRET is set
+profiler = create_profiler()
+profiler.init_app(app)
+
+# Recent request traces, when TRACE_REQUESTS=1 (admins only)
+@app.route('/debug/traces')
+@app.route('/debug/traces/<int:trace_id>')
+def debug_traces(trace_id=None):
+    if not tracing.TRACE_ENABLED:
+        abort(404)
+    if session.get('user_role') != 'N2':
+        abort(403)
+    if trace_id is None:
+        return {'traces': tracing.recent_traces()}
+    trace = tracing.get_trace(trace_id)
+    if trace is None:
+        abort(404)
+    return trace.to_chrome() if request.args.get('format') == 'chrome' else trace.to_dict()
+
 # ---- Helpers ----
 ROLE_ORDER = ['N1', 'N2', 'N3', 'N4']
 RESOLUTION_MINUTES_BY_ROLE = {
@@ -28,42 +110,168 @@ def get_role_id_by_name(role_name: str):
 def current_role_name():
     return session.get('user_role')
 
+def _delete_unused_attachments(storage_keys):
+    for key in db.unused_storage_keys(storage_keys):
+        try:
+            attachment_store.delete(key)
+        except (OSError, ValueError) as e:
+            print(f"Error deleting attachment {key}: {e}")
+
+# Deletes released content once ATTACHMENT_DELETE_GRACE has passed; content
+# pending when the process exits is only left stored, never lost
+attachment_cleanup = DeadlineScheduler(on_due=_delete_unused_attachments, name='attachment-cleanup')
+
+def remove_unused_attachments(storage_keys):
+    """Delete, after ATTACHMENT_DELETE_GRACE seconds, the stored content that no fichier row uses by then"""
+    if not storage_keys:
+        return
+    deadline = (datetime.now() + timedelta(seconds=ATTACHMENT_DELETE_GRACE)).timestamp()
+    for key in storage_keys:
+        attachment_cleanup.schedule(key, deadline)
+    attachment_cleanup.start()
+
+def can_view_ticket(ticket):
+    """Whether the logged-in user may see a ticket: admins, its author, or a level whose queue holds it"""
+    if not ticket:
+        return False
+    role_name = current_role_name()
+    if role_name == 'N2' or ticket.get('idutilisateur') == session.get('user_id'):
+        return True
+    return role_name in ROLE_ORDER and in_resolution_scope(ticket, get_role_id_by_name(role_name), role_name)
+
+# Streamed pages are sent in chunks of about this many characters
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 8192))
+# Written as {{ stream_flush }} in a streamed template: sends everything rendered so far
+STREAM_FLUSH = Markup('<!-- flush -->')
+
+def stream_page(template_name, **context):
+    """Render a template as a streamed response.
+
+    Jinja's small fragments are joined into chunks of about STREAM_CHUNK_SIZE
+    characters, and {{ stream_flush }} sends the pending chunk at once, e.g.
+    the page head before a lazy TicketPageStream or iter_users runs its
+    query. The whole page is never held in memory.
+
+    The session cookie is saved before the body is rendered, so a streamed
+    template must not read flashed messages itself: pass them in with
+    messages=get_flashed_messages(with_categories=True).
+    """
+    g.streamed_page = True
+    fragments = stream_template(template_name, stream_flush=STREAM_FLUSH, **context)
+
+    def chunks():
+        buffered, size = [], 0
+        for fragment in fragments:
+            if fragment == STREAM_FLUSH or size >= STREAM_CHUNK_SIZE:
+                if buffered:
+                    yield ''.join(buffered)
+                buffered, size = [], 0
+                if fragment == STREAM_FLUSH:
+                    continue
+            buffered.append(fragment)
+            size += len(fragment)
+        if buffered:
+            yield ''.join(buffered)
+
+    return Response(chunks(), mimetype='text/html')
+
+# (reference-data version, rendered habilitation <option> list)
+_habilitation_options = (None, Markup(''))
+
+def habilitation_options(reference):
+    """<option> list of every habilitation, rendered once per ReferenceData version"""
+    global _habilitation_options
+    version, options = _habilitation_options
+    if version != reference.version:
+        habilitations = [(h['id'], h['nom'], h['categorie']) for h in reference.all('habilitations')]
+        options = Markup(render_template('_habilitation_options.html', habilitations=habilitations))
+        # Swapped as one tuple, so concurrent requests never pair a version with another list
+        _habilitation_options = (reference.version, options)
+    return options
+
+# Query-string names of the ticket list filters, mapped to SupabaseDB filter keys
+TICKET_FILTER_ARGS = {
+    'statut': 'status',
+    'categorie': 'category',
+    'role': 'role',
+    'date_debut': 'date_from',
+    'date_fin': 'date_to',
+}
+
+def ticket_list_args():
+    """Read ticket list filters from the query string.
+
+    Returns (filters for SupabaseDB, non-empty args to carry over in page links).
+    """
+    filters = {}
+    filter_args = {}
+    for arg, key in TICKET_FILTER_ARGS.items():
+        value = request.args.get(arg, '').strip()
+        if not value:
+            continue
+        if key in ('status', 'category', 'role'):
+            if not value.isdigit():
+                continue
+            value = int(value)
+        filters[key] = value
+        filter_args[arg] = value
+    return filters, filter_args
+
 def ensure_ticket_columns():
     # No longer needed with Supabase - schema is already defined
     pass
 
 # Background watcher to auto-mark tickets as resolved when due
+RESOLUTION_RECONCILE_SECONDS = float(os.environ.get('RESOLUTION_RECONCILE_SECONDS', '300'))
 _watcher_started = False
 
+def _deadline_timestamp(value):
+    """Convert a resolution_due_at value to a time.time() timestamp"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    # Naive values are local time, as written by resoudre_ticket
+    return datetime.fromisoformat(value).timestamp()
+
+def _load_resolution_deadlines():
+    return [(t['id'], _deadline_timestamp(t['resolution_due_at'])) for t in db.get_resolution_deadlines()]
+
+def _resolve_due_tickets(ticket_ids):
+    # One PATCH per chunk of ids, however many deadlines fell together
+    db.resolve_due_tickets(ticket_ids)
+
+# Sleeps until the next resolution deadline. Every process fires the deadlines
+# it set itself; only the leader also reconciles with Supabase to pick up
+# deadlines set elsewhere or missed after an error
+resolution_scheduler = DeadlineScheduler(
+    on_due=_resolve_due_tickets,
+    name='resolution-watcher',
+)
+
+def start_resolution_reconciliation():
+    resolution_scheduler.enable_reconcile(_load_resolution_deadlines, RESOLUTION_RECONCILE_SECONDS)
+    resolution_scheduler.start()
+
+# Background jobs run in a single process per host: every worker competes for
+# the lock file and the leader starts the jobs; another takes over if it dies
+background_jobs = LeaderElection(
+    os.environ.get('LEADER_LOCK_PATH') or os.path.join(private_tempdir(), 'leader.lock'),
+    poll_interval=float(os.environ.get('LEADER_POLL_SECONDS', '2')),
+    name='background-jobs',
+)
+background_jobs.add_job(start_resolution_reconciliation)
+
 def start_resolution_watcher():
     global _watcher_started
     if _watcher_started:
         return
     _watcher_started = True
+    background_jobs.start()
 
-    def _loop():
-        while True:
-            try:
-                # Get status IDs
-                in_progress_id = db.get_status_by_name('Incident en cours de résolution')
-                resolved_id = db.get_status_by_name('Incident résolu')
-                
-                if in_progress_id and resolved_id:
-                    # Find tickets due for resolution
-                    due_tickets = db.get_tickets_due_for_resolution()
-                    if due_tickets:
-                        for ticket in due_tickets:
-                            db.update_ticket_status(ticket['id'], resolved_id)
-            except Exception as e:
-                print(f"Resolution watcher error: {e}")
-            time.sleep(5)
-
-    t = threading.Thread(target=_loop, daemon=True)
-    t.start()
-
-# Ensure columns and start watcher when module loads
+# Ensure columns when module loads. The watcher starts with the first request
+# instead: under gunicorn --preload the module is imported by the master, and
+# the election (and the SupabaseDB its jobs build) must happen in the workers
 ensure_ticket_columns()
-start_resolution_watcher()
+app.before_request(start_resolution_watcher)
 
 
 @app.route('/')
@@ -137,43 +345,43 @@ def ajouter_ticket():
         type_id = request.form.get('type')
         user_id = session['user_id']
         
-        # Handle file upload
+        # Handle file upload: streamed and hashed in chunks, deduplicated by content
         file = request.files.get('fichier')
-        fichier_id = None
+        stored_file = None
         if file and file.filename:
-            file_data = file.read()
-            file_record = db.create_file({'fichier': file_data.hex()})  # Convert to hex for storage
-            fichier_id = file_record['id'] if file_record else None
-        
-        # Get status ID for 'Incident déclaré'
-        statut_id = db.get_status_by_name('Incident déclaré')
-        if not statut_id:
-            flash('Statut "Incident déclaré" non trouvé dans la base de données.', 'error')
-            return redirect(url_for('ajouter_ticket'))
+            try:
+                stored_file = attachment_store.save(file.stream, file.mimetype)
+            except OSError as e:
+                print(f"Error storing attachment: {e}")
+                flash('Erreur lors de l\'enregistrement du fichier joint.', 'error')
+                return redirect(url_for('ajouter_ticket'))
         
-        # Create ticket data
+        # Create ticket data; the default status and N1 assignment are filled in by open_ticket
         ticket_data = {
             'titre': titre,
             'description': description,
             'date_creation': datetime.now().isoformat(),
             'idutilisateur': user_id,
             'categorie_id': int(categorie_id) if categorie_id else None,
-            'type_id': int(type_id) if type_id else None,
-            'statut_id': statut_id
+            'type_id': int(type_id) if type_id else None
         }
+        attachment = None
+        if stored_file:
+            attachment = {
+                'nom': file.filename,
+                'storage_key': stored_file.key,
+                'sha256': stored_file.sha256,
+                'size_bytes': stored_file.size,
+                'content_type': stored_file.content_type
+            }
         
-        # Create ticket
-        ticket = db.create_ticket(ticket_data)
+        # Create ticket and attachment link in one request
+        ticket = db.open_ticket(ticket_data, attachment=attachment, idempotency_key=request.form.get('idempotency_key'))
+        if not ticket and stored_file and stored_file.created:
+            # Nothing points at the content this request stored
+            remove_unused_attachments([stored_file.key])
         
         if ticket:
-            # Assign to N1 by default
-            n1_id = get_role_id_by_name('N1')
-            if n1_id:
-                db.update_ticket(ticket['id'], {'assigned_role_id': n1_id})
-            
-            # Invalidate cache for dashboard data
-            db.invalidate_cache('dashboard')
-            
             flash('Ticket créé avec succès !', 'success')
         else:
             flash('Erreur lors de la création du ticket', 'error')
@@ -192,7 +400,46 @@ def ajouter_ticket():
             return redirect(url_for('dashboard_n4'))
         return redirect(url_for('dashboard_initial'))
     
-    return render_template('ajouter_ticket.html', categories=categories, types=types)
+    return render_template('ajouter_ticket.html', categories=categories, types=types, idempotency_key=uuid.uuid4().hex)
+
+@app.route('/fichiers/<int:file_id>')
+def telecharger_fichier(file_id: int):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    # Unknown and forbidden files both answer 404, so file ids cannot be probed
+    fichier = db.get_file_by_id(file_id)
+    if not fichier or not fichier.get('storage_key') or not can_view_ticket(fichier.get('ticket')):
+        abort(404)
+    download_name = fichier.get('nom') or f"fichier-{file_id}"
+    try:
+        path = attachment_store.path_for(fichier['storage_key'])
+        if path is None:
+            # Not on local disk: the store serves the content from a short-lived signed URL
+            url = attachment_store.download_url(fichier['storage_key'], download_name)
+            if not url:
+                abort(404)
+            return redirect(url)
+    except (ValueError, OSError) as e:
+        print(f"Error serving attachment {file_id}: {e}")
+        abort(404)
+    if not os.path.exists(path):
+        abort(404)
+
+    # Served from its path: Werkzeug answers Range (206) and If-None-Match (304)
+    # requests and hands the body to wsgi.file_wrapper (sendfile) or X-Sendfile
+    response = send_file(
+        path,
+        mimetype=fichier.get('content_type') or 'application/octet-stream',
+        as_attachment=True,
+        download_name=download_name,
+        etag=fichier.get('sha256') or fichier['storage_key'],
+        conditional=True,
+        max_age=ATTACHMENT_MAX_AGE,
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
 @app.route('/logout')
 def logout():
@@ -317,32 +564,38 @@ def resoudre_tickets():
     user_id = session['user_id']
     role_name = current_role_name()
     current_role_id = get_role_id_by_name(role_name)
+    filters, filter_args = ticket_list_args()
+    filters.pop('role', None)
+    filter_args.pop('role', None)
 
-    # Get all resolution dashboard data in optimized queries
-    dashboard_data = db.get_resolution_dashboard_data(current_role_id, role_name)
-    tickets_data = dashboard_data['tickets']
-    habilitations_data = dashboard_data['habilitations']
-    role_hab_ids = dashboard_data['role_hab_ids']
-
+    reference = db.get_reference_data()
+    
+    # The ticket query runs once the page head has been sent (see stream_page)
+    page = db.stream_ticket_page(
+        'resolution', scope=resolution_scope(current_role_id, role_name), filters=filters,
+        after=request.args.get('apres'), before=request.args.get('avant')
+    )
+    
     # Format tickets for template
-    tickets = []
-    for t in tickets_data:
-        ticket_tuple = (
-            t['id'], 
-            t['titre'], 
-            t['utilisateur']['nom_utilisateur'], 
-            t['description'], 
-            t['date_creation'],
-            t['statut']['nom'], 
-            t.get('required_habilitation_id'), 
-            t.get('assigned_role_id')
-        )
-        tickets.append(ticket_tuple)
-
-    # Format habilitations for template
-    habilitations = [(h['id'], h['nom'], h['categorie']) for h in habilitations_data]
-
-    return render_template('resoudre_tickets.html', tickets=tickets, habilitations=habilitations, role_name=role_name, role_hab_ids=role_hab_ids)
+    tickets = ((
+        t['id'], 
+        t['titre'], 
+        t['utilisateur']['nom_utilisateur'], 
+        t['description'], 
+        t['date_creation'],
+        t['statut']['nom'], 
+        t.get('required_habilitation_id'), 
+        t.get('assigned_role_id')
+    ) for t in page)
+    
+    role_hab_ids = db.get_permission_matrix().habilitation_ids(current_role_id) if current_role_id else frozenset()
+    
+    # Format data for filter dropdowns
+    statuts = [(s['id'], s['nom']) for s in reference.all('statuses')]
+    categories = [(c['id'], c['nom']) for c in reference.all('categories')]
+    
+    return stream_page('resoudre_tickets.html', tickets=tickets, page=page, habilitation_options=habilitation_options(reference),
+                       role_name=role_name, role_hab_ids=role_hab_ids, statuts=statuts, categories=categories, filters=filter_args)
 
 # ---- Gestion des tickets (Admin only) ----
 @app.route('/gestion-tickets')
@@ -350,37 +603,36 @@ def gestion_tickets():
     if 'user_id' not in session or session.get('user_role') != 'N2':
         return redirect(url_for('login'))
     
-    # Get all admin dashboard data in optimized queries
-    dashboard_data = db.get_admin_dashboard_data()
-    tickets_data = dashboard_data['tickets']
-    statuts_data = dashboard_data['statuses']
-    users_data = dashboard_data['users']
-    categories_data = dashboard_data['categories']
-    types_data = dashboard_data['types']
+    filters, filter_args = ticket_list_args()
+    
+    reference = db.get_reference_data()
+    
+    # The ticket query runs once the page head has been sent (see stream_page)
+    page = db.stream_ticket_page(
+        'admin', filters=filters, after=request.args.get('apres'), before=request.args.get('avant')
+    )
     
     # Format tickets for template
-    tickets = []
-    for t in tickets_data:
-        tickets.append((
-            t['id'], 
-            t['titre'], 
-            t['utilisateur']['nom_utilisateur'], 
-            t['description'], 
-            t['date_creation'],
-            t['statut']['nom'], 
-            t.get('required_habilitation_id'), 
-            t.get('assigned_role_id'),
-            t['utilisateur'].get('prenom', ''), 
-            t['utilisateur'].get('nom', '')
-        ))
+    tickets = ((
+        t['id'], 
+        t['titre'], 
+        t['utilisateur']['nom_utilisateur'], 
+        t['description'], 
+        t['date_creation'],
+        t['statut']['nom'], 
+        t.get('required_habilitation_id'), 
+        t.get('assigned_role_id'),
+        t['utilisateur'].get('prenom', ''), 
+        t['utilisateur'].get('nom', '')
+    ) for t in page)
     
     # Format data for dropdowns
-    statuts = [(s['id'], s['nom']) for s in statuts_data]
-    users = [(u['id'], u['nom_utilisateur'], u.get('prenom', ''), u.get('nom', '')) for u in users_data]
-    categories = [(c['id'], c['nom']) for c in categories_data]
-    types = [(t['id'], t['nom']) for t in types_data]
+    statuts = [(s['id'], s['nom']) for s in reference.all('statuses')]
+    categories = [(c['id'], c['nom']) for c in reference.all('categories')]
+    roles = [(r['id'], r['nom']) for r in reference.all('roles')]
     
-    return render_template('gestion_tickets.html', tickets=tickets, statuts=statuts, users=users, categories=categories, types=types)
+    return stream_page('gestion_tickets.html', tickets=tickets, page=page, statuts=statuts, categories=categories,
+                       roles=roles, filters=filter_args, messages=get_flashed_messages(with_categories=True))
 
 @app.route('/ajouter-ticket-admin', methods=['GET', 'POST'])
 def ajouter_ticket_admin():
@@ -408,16 +660,7 @@ def ajouter_ticket_admin():
         statut_id = request.form.get('statut')
         user_id = request.form.get('user_id')
         
-        # Get status ID - use provided statut_id or default to 'Incident déclaré'
-        if statut_id:
-            final_statut_id = int(statut_id)
-        else:
-            final_statut_id = db.get_status_by_name('Incident déclaré')
-            if not final_statut_id:
-                flash('Statut "Incident déclaré" non trouvé dans la base de données.', 'error')
-                return redirect(url_for('ajouter_ticket_admin'))
-        
-        # Create ticket data
+        # Create ticket data; without a chosen status it defaults to 'Incident déclaré'
         ticket_data = {
             'titre': titre,
             'description': description,
@@ -425,11 +668,11 @@ def ajouter_ticket_admin():
             'idutilisateur': int(user_id) if user_id else None,
             'categorie_id': int(categorie_id) if categorie_id else None,
             'type_id': int(type_id) if type_id else None,
-            'statut_id': final_statut_id
+            'statut_id': int(statut_id) if statut_id else None
         }
         
-        # Create ticket
-        ticket = db.create_ticket(ticket_data)
+        # Create ticket in one request
+        ticket = db.open_ticket(ticket_data, idempotency_key=request.form.get('idempotency_key'))
         if ticket:
             flash('Ticket créé avec succès !', 'success')
         else:
@@ -437,7 +680,8 @@ def ajouter_ticket_admin():
         
         return redirect(url_for('gestion_tickets'))
     
-    return render_template('ajouter_ticket_admin.html', categories=categories, types=types, statuts=statuts, users=users)
+    return render_template('ajouter_ticket_admin.html', categories=categories, types=types, statuts=statuts, users=users,
+                           idempotency_key=uuid.uuid4().hex)
 
 @app.route('/modifier-ticket/<int:ticket_id>', methods=['GET', 'POST'])
 def modifier_ticket(ticket_id):
@@ -478,8 +722,6 @@ def modifier_ticket(ticket_id):
         # Update ticket
         ticket = db.update_ticket(ticket_id, ticket_data)
         if ticket:
-            # Invalidate cache for dashboard data
-            db.invalidate_cache('dashboard')
             flash('Ticket modifié avec succès !', 'success')
         else:
             flash('Erreur lors de la modification du ticket', 'error')
@@ -505,19 +747,21 @@ def modifier_ticket(ticket_id):
         ticket_data['utilisateur'].get('prenom', ''),
         ticket_data['utilisateur'].get('nom', '')
     )
+    fichiers = [(f['id'], f.get('nom') or f"fichier-{f['id']}", f.get('size_bytes')) for f in ticket_data.get('fichier') or []]
     
-    return render_template('modifier_ticket.html', ticket=ticket, categories=categories, types=types, statuts=statuts, users=users)
+    return render_template('modifier_ticket.html', ticket=ticket, categories=categories, types=types, statuts=statuts, users=users,
+                           fichiers=fichiers)
 
 @app.route('/supprimer-ticket/<int:ticket_id>', methods=['POST'])
 def supprimer_ticket(ticket_id):
     if 'user_id' not in session or session.get('user_role') != 'N2':
         return redirect(url_for('login'))
     
-    # Delete ticket
+    # The attachment rows go with the ticket; their content once no other row uses it
+    storage_keys = db.get_ticket_storage_keys(ticket_id)
     success = db.delete_ticket(ticket_id)
     if success:
-        # Invalidate cache for dashboard data
-        db.invalidate_cache('dashboard')
+        remove_unused_attachments(storage_keys)
         flash('Ticket supprimé avec succès !', 'success')
     else:
         flash('Erreur lors de la suppression du ticket', 'error')
@@ -534,24 +778,16 @@ def qualifier_ticket(ticket_id: int):
         flash('Veuillez sélectionner une habilitation.', 'error')
         return redirect(url_for('resoudre_tickets'))
     
-    # Get status ID for 'Incident pris en charge'
-    statut_id = db.get_status_by_name('Incident pris en charge')
-    if not statut_id:
-        flash('Statut non trouvé.', 'error')
-        return redirect(url_for('resoudre_tickets'))
-    
-    # Update ticket with required habilitation and status
-    success = db.update_ticket(ticket_id, {
-        'required_habilitation_id': int(required_hab_id),
-        'statut_id': statut_id
-    })
+    # Qualify an unqualified ticket of the N1 queue, in one conditional update
+    role_id = get_role_id_by_name('N1')
+    success = db.transition_ticket(ticket_id, 'qualify', {
+        'required_habilitation_id': int(required_hab_id)
+    }, [('required_habilitation_id', 'is.null'), ('and', f"({resolution_scope(role_id, 'N1')})")])
     
     if success:
-        # Invalidate cache for dashboard data
-        db.invalidate_cache('dashboard')
         flash('Qualification enregistrée.', 'success')
     else:
-        flash('Erreur lors de la qualification.', 'error')
+        flash('Erreur lors de la qualification : le ticket a peut-être déjà été traité.', 'error')
     
     return redirect(url_for('resoudre_tickets'))
 
@@ -583,24 +819,16 @@ def escalader_ticket(ticket_id: int):
         flash('Rôle suivant introuvable.', 'error')
         return redirect(url_for('resoudre_tickets'))
     
-    # Get status ID for 'Incident pris en charge'
-    statut_id = db.get_status_by_name('Incident pris en charge')
-    if not statut_id:
-        flash('Statut non trouvé.', 'error')
-        return redirect(url_for('resoudre_tickets'))
-    
-    # Update ticket with new assigned role and status
-    success = db.update_ticket(ticket_id, {
-        'assigned_role_id': next_role_id,
-        'statut_id': statut_id
-    })
+    # Hand a qualified ticket of this level's queue to the next level, in one conditional update
+    success = db.transition_ticket(ticket_id, 'escalate', {
+        'assigned_role_id': next_role_id
+    }, [('required_habilitation_id', 'not.is.null'),
+        ('and', f"({resolution_scope(get_role_id_by_name(role_name), role_name)})")])
     
     if success:
-        # Invalidate cache for dashboard data
-        db.invalidate_cache('dashboard')
         flash(f'Ticket escaladé vers {next_role}.', 'success')
     else:
-        flash('Erreur lors de l\'escalade.', 'error')
+        flash('Erreur lors de l\'escalade : le ticket a peut-être déjà été traité.', 'error')
     
     return redirect(url_for('resoudre_tickets'))
 
@@ -611,173 +839,76 @@ def resoudre_ticket(ticket_id: int):
     
     role_name = current_role_name()
     
-    # Get ticket data
-    ticket_data = db.get_ticket_by_id(ticket_id)
-    if not ticket_data:
-        flash('Ticket non trouvé.', 'error')
-        return redirect(url_for('resoudre_tickets'))
-    
-    required_hab_id = ticket_data.get('required_habilitation_id')
-    attempts = ticket_data.get('resolution_attempts', 0)
-    
-    # Check if user can resolve this ticket
-    allowed = False
-    if role_name == 'N4':
-        allowed = True
-    elif required_hab_id is not None:
-        # Check if role has the required habilitation
+    # N4 may resolve any qualified ticket; other levels need the required habilitation
+    habilitation_ids = None
+    if role_name != 'N4':
         role_id = get_role_id_by_name(role_name)
-        if role_id:
-            allowed = db.check_role_has_habilitation(role_id, required_hab_id)
-    
-    if not allowed:
-        flash("Vous n'avez pas l'habilitation requise pour résoudre ce ticket.", 'error')
-        return redirect(url_for('resoudre_tickets'))
-    
-    # Get status ID for 'Incident en cours de résolution'
-    statut_id = db.get_status_by_name('Incident en cours de résolution')
-    if not statut_id:
-        flash('Statut non trouvé.', 'error')
-        return redirect(url_for('resoudre_tickets'))
+        habilitation_ids = db.get_permission_matrix().habilitation_ids(role_id) if role_id else frozenset()
     
     # Calculate resolution due time
     minutes = RESOLUTION_MINUTES_BY_ROLE.get(role_name, 2)
     due_at = datetime.now() + timedelta(minutes=minutes)
     
-    # Update ticket with resolution status and due time
-    success = db.update_ticket(ticket_id, {
-        'statut_id': statut_id,
-        'date_mise_a_jour': datetime.now().isoformat(),
-        'resolution_due_at': due_at.isoformat(),
-        'resolution_attempts': attempts + 1
-    })
+    # Start the resolution and count the attempt in one conditional update
+    success = db.start_ticket_resolution(ticket_id, due_at, habilitation_ids)
     
     if success:
-        # Invalidate cache for dashboard data
-        db.invalidate_cache('dashboard')
+        resolution_scheduler.schedule(ticket_id, due_at.timestamp())
+        resolution_scheduler.start()
         flash(f'Ticket en résolution ({minutes} min).', 'success')
     else:
-        flash('Erreur lors de la mise en résolution.', 'error')
+        flash("Impossible de mettre ce ticket en résolution : habilitation requise manquante ou ticket déjà traité.", 'error')
     
     return redirect(url_for('resoudre_tickets'))
 
+def redirect_to_dashboard():
+    """Redirect to the dashboard of the logged-in user's role"""
+    user_role = session.get('user_role')
+    if user_role == 'N2':
+        return redirect(url_for('dashboard_admin'))
+    elif user_role == 'N1':
+        return redirect(url_for('dashboard_n1'))
+    elif user_role == 'N3':
+        return redirect(url_for('dashboard_n3'))
+    elif user_role == 'N4':
+        return redirect(url_for('dashboard_n4'))
+    return redirect(url_for('dashboard_initial'))
+
 # Endpoints for requester validation
 @app.route('/tickets/<int:ticket_id>/valider', methods=['POST'])
 def valider_ticket(ticket_id: int):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Only the creator can validate/refuse
-    ticket_data = db.get_ticket_by_id(ticket_id)
-    if not ticket_data or ticket_data.get('idutilisateur') != session['user_id']:
-        flash("Vous ne pouvez valider que vos propres tickets.", 'error')
-        # Redirect to appropriate dashboard based on user role
-        user_role = session.get('user_role')
-        if user_role == 'N2':
-            return redirect(url_for('dashboard_admin'))
-        elif user_role == 'N1':
-            return redirect(url_for('dashboard_n1'))
-        elif user_role == 'N3':
-            return redirect(url_for('dashboard_n3'))
-        elif user_role == 'N4':
-            return redirect(url_for('dashboard_n4'))
-        else:
-            return redirect(url_for('dashboard_initial'))
-    
-    # Get status ID for 'Incident clos'
-    statut_id = db.get_status_by_name('Incident clos')
-    if not statut_id:
-        flash('Statut non trouvé.', 'error')
-        return redirect(url_for('dashboard_initial'))
-    
-    # Update ticket with closed status
-    success = db.update_ticket(ticket_id, {
-        'statut_id': statut_id,
+    # Only the creator can validate a resolved ticket
+    success = db.transition_ticket(ticket_id, 'close', {
         'date_cloture': datetime.now().isoformat()
-    })
+    }, [('idutilisateur', f"eq.{session['user_id']}")])
     
     if success:
-        # Invalidate cache for dashboard data
-        db.invalidate_cache('dashboard')
         flash('Ticket clôturé avec succès.', 'success')
     else:
-        flash('Erreur lors de la clôture.', 'error')
+        flash("Vous ne pouvez valider que vos propres tickets résolus.", 'error')
     
-    # Redirect to appropriate dashboard based on user role
-    user_role = session.get('user_role')
-    if user_role == 'N2':
-        return redirect(url_for('dashboard_admin'))
-    elif user_role == 'N1':
-        return redirect(url_for('dashboard_n1'))
-    elif user_role == 'N3':
-        return redirect(url_for('dashboard_n3'))
-    elif user_role == 'N4':
-        return redirect(url_for('dashboard_n4'))
-    else:
-        return redirect(url_for('dashboard_initial'))
+    return redirect_to_dashboard()
 
 @app.route('/tickets/<int:ticket_id>/refuser', methods=['POST'])
 def refuser_ticket(ticket_id: int):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Only the creator can refuse
-    ticket_data = db.get_ticket_by_id(ticket_id)
-    if not ticket_data or ticket_data.get('idutilisateur') != session['user_id']:
-        flash("Vous ne pouvez refuser que vos propres tickets.", 'error')
-        # Redirect to appropriate dashboard based on user role
-        user_role = session.get('user_role')
-        if user_role == 'N2':
-            return redirect(url_for('dashboard_admin'))
-        elif user_role == 'N1':
-            return redirect(url_for('dashboard_n1'))
-        elif user_role == 'N3':
-            return redirect(url_for('dashboard_n3'))
-        elif user_role == 'N4':
-            return redirect(url_for('dashboard_n4'))
-        else:
-            return redirect(url_for('dashboard_initial'))
-    
-    titre = ticket_data.get('titre', '')
-    new_title = (titre + ' [Retour - solution non concluante]').strip()
-    
-    # Get status ID for 'Incident déclaré'
-    statut_id = db.get_status_by_name('Incident déclaré')
-    if not statut_id:
-        flash('Statut non trouvé.', 'error')
-        return redirect(url_for('dashboard_initial'))
-    
-    # Get N1 role ID for reassignment
-    n1_role_id = get_role_id_by_name('N1')
-    
-    # Reset ticket to initial state
-    success = db.update_ticket(ticket_id, {
-        'statut_id': statut_id,
-        'titre': new_title,
-        'resolution_due_at': None,
-        'required_habilitation_id': None,
-        'assigned_role_id': n1_role_id
-    })
+    # Only the creator can refuse; the ticket goes back to N1
+    success = db.refuse_ticket_resolution(
+        ticket_id, session['user_id'], '[Retour - solution non concluante]', get_role_id_by_name('N1')
+    )
     
     if success:
-        # Invalidate cache for dashboard data
-        db.invalidate_cache('dashboard')
+        resolution_scheduler.cancel(ticket_id)
         flash('Ticket renvoyé pour nouveau traitement.', 'success')
     else:
-        flash('Erreur lors du renvoi.', 'error')
+        flash("Vous ne pouvez refuser que vos propres tickets résolus.", 'error')
     
-    # Redirect to appropriate dashboard based on user role
-    user_role = session.get('user_role')
-    if user_role == 'N2':
-        return redirect(url_for('dashboard_admin'))
-    elif user_role == 'N1':
-        return redirect(url_for('dashboard_n1'))
-    elif user_role == 'N3':
-        return redirect(url_for('dashboard_n3'))
-    elif user_role == 'N4':
-        return redirect(url_for('dashboard_n4'))
-    else:
-        return redirect(url_for('dashboard_initial'))
+    return redirect_to_dashboard()
 
 # User Management Routes
 @app.route('/gestion-utilisateurs')
@@ -785,20 +916,17 @@ def gestion_utilisateurs():
     if 'user_id' not in session or session.get('user_role') != 'N2':
         return redirect(url_for('login'))
     
-    # Get all users with role information
-    users_data = db.get_all_users()
-    users = []
-    for u in users_data:
-        users.append((
-            u['id'],
-            u['nom_utilisateur'],
-            u['email'],
-            u.get('prenom', ''),
-            u.get('nom', ''),
-            u['role']['nom'] if u.get('role') else 'N/A'
-        ))
-    
-    return render_template('gestion_utilisateurs.html', users=users)
+    # Users with role information, read in chunks while the table is streamed
+    users = ((
+        u['id'],
+        u['nom_utilisateur'],
+        u['email'],
+        u.get('prenom', ''),
+        u.get('nom', ''),
+        u['role']['nom'] if u.get('role') else 'N/A'
+    ) for u in db.iter_users())
+    
+    return stream_page('gestion_utilisateurs.html', users=users, messages=get_flashed_messages(with_categories=True))
 
 @app.route('/ajouter-utilisateur', methods=['GET', 'POST'])
 def ajouter_utilisateur():
@@ -840,8 +968,6 @@ def ajouter_utilisateur():
         # Create user
         user = db.create_user(user_data)
         if user:
-            # Invalidate cache for user data
-            db.invalidate_cache('users')
             flash('Utilisateur ajouté avec succès !', 'success')
             return redirect(url_for('gestion_utilisateurs'))
         else:
@@ -893,8 +1019,6 @@ def modifier_utilisateur(user_id):
         # Update user
         user = db.update_user(user_id, user_data)
         if user:
-            # Invalidate cache for user data
-            db.invalidate_cache('users')
             flash('Utilisateur modifié avec succès !', 'success')
         else:
             flash('Erreur lors de la modification de l\'utilisateur', 'error')
@@ -932,6 +1056,9 @@ def supprimer_utilisateur(user_id):
     
     # Check if user has any tickets
     ticket_count = db.get_user_count(user_id)
+    if ticket_count is None:
+        flash('Erreur lors de la vérification des tickets de l\'utilisateur', 'error')
+        return redirect(url_for('gestion_utilisateurs'))
     if ticket_count > 0:
         flash('Impossible de supprimer cet utilisateur car il a des tickets associés.', 'error')
         return redirect(url_for('gestion_utilisateurs'))
@@ -939,8 +1066,6 @@ def supprimer_utilisateur(user_id):
     # Delete user
     success = db.delete_user(user_id)
     if success:
-        # Invalidate cache for user data
-        db.invalidate_cache('users')
         flash('Utilisateur supprimé avec succès !', 'success')
     else:
         flash('Erreur lors de la suppression de l\'utilisateur', 'error')
@@ -1005,13 +1130,9 @@ def ajouter_habilitation_role(role_id):
         return redirect(url_for('gestion_habilitations_role', role_id=role_id))
     
     # Add habilitation to role
-    try:
-        result = db._make_request("POST", "role_habilitation", data={
-            'role_id': role_id,
-            'habilitation_id': int(habilitation_id)
-        })
+    if db.add_role_habilitation(role_id, int(habilitation_id)):
         flash('Habilitation ajoutée au rôle avec succès !', 'success')
-    except Exception as e:
+    else:
         flash('Erreur lors de l\'ajout de l\'habilitation.', 'error')
     
     return redirect(url_for('gestion_habilitations_role', role_id=role_id))
@@ -1021,10 +1142,9 @@ def supprimer_habilitation_role(role_id, habilitation_id):
     if 'user_id' not in session or session.get('user_role') != 'N2':
         return redirect(url_for('login'))
     
-    try:
-        db._make_request("DELETE", f"role_habilitation?role_id=eq.{role_id}&habilitation_id=eq.{habilitation_id}")
+    if db.remove_role_habilitation(role_id, habilitation_id):
         flash('Habilitation supprimée du rôle avec succès !', 'success')
-    except Exception as e:
+    else:
         flash('Erreur lors de la suppression de l\'habilitation.', 'error')
     
     return redirect(url_for('gestion_habilitations_role', role_id=role_id))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Attachment Store Module
+Streams ticket attachments to content-addressed storage (a Supabase Storage
+bucket or a local directory); only metadata goes to the fichier table
+"""
+
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from urllib.parse import quote
+
+import requests
+
+# Bytes read from an upload at a time; peak memory per upload stays at one chunk
+CHUNK_SIZE = 64 * 1024
+
+
+def content_path(key):
+    """Relative location <aa>/<bb>/<sha256> of a content key; ValueError if key is not a SHA-256"""
+    if len(key) != 64 or any(c not in '0123456789abcdef' for c in key):
+        raise ValueError(f"Invalid attachment key: {key!r}")
+    return f"{key[:2]}/{key[2:4]}/{key}"
+
+
+class StoredFile:
+    """Result of storing an upload"""
+
+    __slots__ = ('key', 'sha256', 'size', 'content_type', 'created')
+
+    def __init__(self, key, sha256, size, content_type, created=True):
+        self.key = key
+        self.sha256 = sha256
+        self.size = size
+        self.content_type = content_type
+        # False when the content was already stored (deduplicated)
+        self.created = created
+
+
+class AttachmentStore(ABC):
+    """Interface of the attachment storage backends"""
+
+    @abstractmethod
+    def save(self, stream, content_type=None):
+        """Store a binary stream, returning a StoredFile"""
+
+    @abstractmethod
+    def open(self, key):
+        """Open a stored file for binary reading"""
+
+    def path_for(self, key):
+        """Local filesystem path of a stored key, so downloads can be served with sendfile; None if not on disk"""
+        return None
+
+    def download_url(self, key, filename):
+        """Short-lived URL serving the content as filename, for stores that are not on disk; None otherwise"""
+        return None
+
+    @abstractmethod
+    def exists(self, key):
+        """Whether content is stored under key"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove stored content; content is shared, so only once no fichier row uses key"""
+
+
+class LocalDiskAttachmentStore(AttachmentStore):
+    """Content-addressed store on the local filesystem.
+
+    Uploads are streamed in CHUNK_SIZE pieces to a temporary file while their
+    SHA-256 is computed, then renamed to root/<aa>/<bb>/<sha256>. Identical
+    content is stored once. Directories are created by the first save, so
+    building the store never writes to disk.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, key):
+        return os.path.join(self.root, *content_path(key).split('/'))
+
+    def save(self, stream, content_type=None):
+        digest = hashlib.sha256()
+        size = 0
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+
+            key = digest.hexdigest()
+            path = self.path_for(key)
+            created = not os.path.exists(path)
+            if not created:
+                # Deduplicated: the same content is already stored
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return StoredFile(key, key, size, content_type or 'application/octet-stream', created)
+
+    def open(self, key):
+        return open(self.path_for(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+
+class SupabaseStorageAttachmentStore(AttachmentStore):
+    """Content-addressed store in a private Supabase Storage bucket.
+
+    Uploads are streamed in CHUNK_SIZE pieces to a temporary file while their
+    SHA-256 is computed, then sent once to <bucket>/<aa>/<bb>/<sha256>; content
+    already in the bucket is not replaced. Downloads are redirected to signed
+    URLs valid for url_ttl seconds. Request errors are raised as OSError,
+    like disk errors of the local store.
+    """
+
+    def __init__(self, url, api_key, bucket, url_ttl=60, connect_timeout=5.0, read_timeout=60.0):
+        self.base_url = f"{url.rstrip('/')}/storage/v1"
+        self.bucket = bucket
+        self.url_ttl = url_ttl
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({"apikey": api_key, "Authorization": f"Bearer {api_key}"})
+
+    def _request(self, method, path, **kwargs):
+        try:
+            return self.session.request(method, f"{self.base_url}/{path}", timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise OSError(f"Supabase Storage {method} {path} failed: {e}") from e
+
+    def _check(self, response, action):
+        if response.status_code >= 400:
+            raise OSError(f"Supabase Storage could not {action}: {response.status_code} {response.text[:200]}")
+
+    def save(self, stream, content_type=None):
+        digest = hashlib.sha256()
+        size = 0
+        content_type = content_type or 'application/octet-stream'
+        with tempfile.TemporaryFile() as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+            tmp.seek(0)
+
+            key = digest.hexdigest()
+            response = self._request("POST", f"object/{self.bucket}/{content_path(key)}", data=tmp,
+                                     headers={"Content-Type": content_type, "x-upsert": "false"})
+        # Deduplicated: the bucket refuses to replace the same content
+        created = not (response.status_code == 409 or (response.status_code == 400 and 'exists' in response.text))
+        if created:
+            self._check(response, f"store {key}")
+        return StoredFile(key, key, size, content_type, created)
+
+    def open(self, key):
+        response = self._request("GET", f"object/authenticated/{self.bucket}/{content_path(key)}", stream=True)
+        if response.status_code in (400, 404):
+            response.close()
+            raise FileNotFoundError(key)
+        self._check(response, f"read {key}")
+        response.raw.decode_content = True
+        return response.raw
+
+    def exists(self, key):
+        response = self._request("HEAD", f"object/authenticated/{self.bucket}/{content_path(key)}")
+        return response.status_code == 200
+
+    def delete(self, key):
+        response = self._request("DELETE", f"object/{self.bucket}/{content_path(key)}")
+        if response.status_code not in (400, 404):
+            self._check(response, f"delete {key}")
+
+    def download_url(self, key, filename):
+        response = self._request("POST", f"object/sign/{self.bucket}/{content_path(key)}",
+                                 json={"expiresIn": self.url_ttl})
+        if response.status_code in (400, 404):
+            return None
+        self._check(response, f"sign {key}")
+        signed = response.json().get("signedURL")
+        if not signed:
+            return None
+        return f"{self.base_url}/{signed.lstrip('/')}&download={quote(filename)}"
+
+
+def create_attachment_store():
+    """Build the attachment store selected by ATTACHMENT_STORE.
+
+    'supabase' (the default unless ATTACHMENTS_DIR is set) keeps files in the
+    SUPABASE_STORAGE_BUCKET bucket of the SUPABASE_URL project. 'local' keeps
+    them under ATTACHMENTS_DIR, which must then be set to durable storage:
+    the app refuses to start without it rather than lose uploads in a
+    temporary directory.
+    """
+    backend = os.environ.get('ATTACHMENT_STORE') or ('local' if os.environ.get('ATTACHMENTS_DIR') else 'supabase')
+    if backend == 'local':
+        root = os.environ.get('ATTACHMENTS_DIR')
+        if not root:
+            raise ValueError("ATTACHMENT_STORE=local requires ATTACHMENTS_DIR, a durable directory")
+        return LocalDiskAttachmentStore(root)
+    if backend == 'supabase':
+        url = os.environ.get('SUPABASE_URL')
+        # Same key precedence as SupabaseDB; the bucket is private, so the service role key is expected
+        api_key = (os.environ.get('SUPABASE_SERVICE_ROLE_KEY') or os.environ.get('SUPABASE_KEY')
+                   or os.environ.get('SUPABASE_ANON_KEY'))
+        if not url or not api_key:
+            raise ValueError("ATTACHMENT_STORE=supabase requires SUPABASE_URL and a Supabase key")
+        return SupabaseStorageAttachmentStore(
+            url, api_key,
+            bucket=os.environ.get('SUPABASE_STORAGE_BUCKET', 'attachments'),
+            url_ttl=int(os.environ.get('ATTACHMENT_URL_TTL', 60)),
+        )
+    raise ValueError(f"Unsupported ATTACHMENT_STORE: {backend}")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Cold Start Benchmark
+Measures, in fresh interpreter processes, the time from `import app` to the
+first response, against the fake PostgREST server with a simulated network
+round trip.
+
+    python bench/cold_start.py [--latency 0.05] [--runs 5] [--path /dashboard-initial] [--repo PATH]
+
+Each run is done twice: without the reference-data snapshot file (first boot)
+and with the snapshot left by the previous run (every later boot). --repo
+points at another checkout, e.g. a git worktree of an older commit, to
+compare against it.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from datagen import FIXED_USERS, generate
+from fake_postgrest import start_server
+from run_benchmarks import backend_env
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process: argv = repo, path, user id, role
+CHILD = """
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+with client.session_transaction() as session:
+    session['user_id'] = int(sys.argv[3])
+    session['user_role'] = sys.argv[4]
+    session['user_nom'] = 'cold-start'
+response = client.get(sys.argv[2])
+answered = time.perf_counter()
+print(json.dumps({'import': imported - started, 'first_response': answered - imported,
+                  'status': response.status_code}))
+sys.stdout.flush()
+os._exit(0)
+"""
+
+
+def run_once(repo, path, user_id, role, env):
+    result = subprocess.run([sys.executable, '-c', CHILD, repo, path, str(user_id), role],
+                            env=env, capture_output=True, text=True, timeout=300)
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"cold start run failed:\n{result.stdout}\n{result.stderr}")
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import-to-first-response time of app.py")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every backend request")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/dashboard-initial')
+    parser.add_argument('--role', default='initial', choices=[role for _, role in FIXED_USERS])
+    parser.add_argument('--tickets', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--repo', default=REPO, help="Checkout whose app.py is measured")
+    args = parser.parse_args()
+
+    server = start_server(generate(args.tickets, args.users), latency=args.latency)
+    workdir = tempfile.mkdtemp(prefix="digitickets-cold-")
+    env = dict(os.environ, **backend_env(server, workdir))
+    user_id = next(i for i, (_, role) in enumerate(FIXED_USERS, 1) if role == args.role)
+
+    results = {'no snapshot': [], 'snapshot': []}
+    for _ in range(args.runs):
+        if os.path.exists(env['SUPABASE_SNAPSHOT_PATH']):
+            os.remove(env['SUPABASE_SNAPSHOT_PATH'])
+        results['no snapshot'].append(run_once(args.repo, args.path, user_id, args.role, env))
+        results['snapshot'].append(run_once(args.repo, args.path, user_id, args.role, env))
+    server.shutdown()
+
+    print(f"{args.repo}: GET {args.path} as {args.role}, {args.latency * 1000:g} ms per backend call")
+    print(f"{'boot':12} {'import ms':>10} {'first response ms':>18} {'total ms':>9}  status")
+    for boot, runs in results.items():
+        imported = statistics.median(r['import'] for r in runs) * 1000
+        first = statistics.median(r['first_response'] for r in runs) * 1000
+        statuses = ','.join(sorted({str(r['status']) for r in runs}))
+        print(f"{boot:12} {imported:10.1f} {first:18.1f} {imported + first:9.1f}  {statuses}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Synthetic Data Generator
+Builds DigiTickets tables (reference data, users, tickets, files) for the
+local PostgREST stand-in
+"""
+
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+ROLES = ['initial', 'N1', 'N2', 'N3', 'N4']
+STATUSES = ['Incident déclaré', 'Incident pris en charge', 'Incident en cours de résolution',
+            'Incident résolu', 'Incident clos']
+CATEGORIES = ['Matériel', 'Logiciel', 'Réseau', 'Messagerie', 'Téléphonie', 'Accès', 'Impression', 'Sécurité']
+TYPES = ['Incident', 'Demande', 'Question', 'Problème', 'Changement']
+PRIORITIES = ['Basse', 'Moyenne', 'Haute', 'Critique']
+HABILITATION_CATEGORIES = ['Système', 'Réseau', 'Applicatif', 'Sécurité']
+
+# Fixed accounts the benchmarks log in as: (nom_utilisateur, role)
+FIXED_USERS = [('admin', 'N2'), ('agent_n1', 'N1'), ('agent_n3', 'N3'), ('agent_n4', 'N4'), ('employe', 'initial')]
+
+WORDS = ("poste imprimante réseau messagerie accès compte mot de passe écran lenteur erreur connexion "
+         "serveur application licence badge téléphone VPN sauvegarde fichier partage droits mise à jour").split()
+
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize()
+
+
+def _named(names):
+    return [{'id': i, 'nom': nom} for i, nom in enumerate(names, 1)]
+
+
+def generate(tickets=100000, users=5000, files=2000, seed=42):
+    """Tables as {name: [rows]}, deterministic for a given seed (resolution deadlines aside)"""
+    rng = random.Random(seed)
+    role_ids = {nom: i for i, nom in enumerate(ROLES, 1)}
+    status_ids = {nom: i for i, nom in enumerate(STATUSES, 1)}
+
+    habilitations = [
+        {'id': i, 'nom': f"Habilitation {i}", 'categorie': HABILITATION_CATEGORIES[i % len(HABILITATION_CATEGORIES)]}
+        for i in range(1, 25)
+    ]
+    # N1 holds a few habilitations, each level above holds more
+    role_habilitation = []
+    for nom, count in (('N1', 4), ('N2', 8), ('N3', 14), ('N4', 24)):
+        for hab in habilitations[:count]:
+            role_habilitation.append({'id': len(role_habilitation) + 1, 'role_id': role_ids[nom],
+                                      'habilitation_id': hab['id']})
+
+    utilisateurs = []
+    for i in range(1, users + 1):
+        if i <= len(FIXED_USERS):
+            login, role = FIXED_USERS[i - 1]
+        else:
+            login = f"user{i}"
+            role = rng.choices(ROLES, weights=(90, 4, 1, 3, 2))[0]
+        utilisateurs.append({
+            'id': i, 'nom_utilisateur': login, 'email': f"{login}@example.com", 'mot_de_passe': 'password',
+            'prenom': f"Prénom{i}", 'nom': f"Nom{i}", 'role_id': role_ids[role],
+        })
+
+    start = datetime(2023, 1, 1)
+    # Pending resolutions fall due after the run, so the resolution watcher
+    # does not rewrite thousands of tickets while routes are measured
+    due_from = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    rows = []
+    for i in range(1, tickets + 1):
+        created = start + timedelta(minutes=i * 5 + rng.randint(0, 4))
+        status = rng.choices(STATUSES, weights=(15, 20, 5, 10, 50))[0]
+        qualified = status != STATUSES[0]
+        rows.append({
+            'id': i,
+            'titre': _sentence(rng, rng.randint(3, 7)),
+            'description': _sentence(rng, rng.randint(10, 120)),
+            'date_creation': created.isoformat(),
+            'date_mise_a_jour': (created + timedelta(hours=2)).isoformat() if qualified else None,
+            'date_cloture': (created + timedelta(days=1)).isoformat() if status == STATUSES[4] else None,
+            'statut_id': status_ids[status],
+            'priorite_id': rng.randint(1, len(PRIORITIES)),
+            'categorie_id': rng.randint(1, len(CATEGORIES)),
+            'type_id': rng.randint(1, len(TYPES)),
+            'idutilisateur': rng.randint(1, users),
+            'assigned_role_id': role_ids[rng.choices(['N1', 'N2', 'N3', 'N4'], weights=(60, 10, 20, 10))[0]],
+            'required_habilitation_id': rng.randint(1, len(habilitations)) if qualified else None,
+            'resolution_due_at': (due_from + timedelta(minutes=rng.randint(0, 2880))).isoformat()
+            if status == STATUSES[2] else None,
+            'resolution_attempts': rng.randint(1, 3) if status in STATUSES[2:] else 0,
+            'idempotency_key': None,
+        })
+
+    fichiers = []
+    for i in range(1, min(files, tickets) + 1):
+        digest = f"{rng.getrandbits(256):064x}"
+        fichiers.append({
+            'id': i, 'ticket_id': rng.randint(1, tickets), 'nom': f"capture-{i}.png", 'storage_key': digest,
+            'sha256': digest, 'size_bytes': rng.randint(10_000, 5_000_000), 'content_type': 'image/png',
+            'fichier': None,
+        })
+
+    return {
+        'role': [{'id': i, 'nom': nom, 'description': f"Niveau {nom}"} for nom, i in role_ids.items()],
+        'statut': _named(STATUSES),
+        'categorie': _named(CATEGORIES),
+        'type': _named(TYPES),
+        'priorite': _named(PRIORITIES),
+        'habilitation': habilitations,
+        'role_habilitation': role_habilitation,
+        'utilisateur': utilisateurs,
+        'ticket': rows,
+        'fichier': fichiers,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', required=True, help="JSON file to write")
+    args = parser.parse_args()
+    data = generate(args.tickets, args.users, args.files, args.seed)
+    with open(args.out, 'w') as f:
+        json.dump(data, f, ensure_ascii=False)
+    print(f"Wrote {sum(len(rows) for rows in data.values())} rows to {args.out}")
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Fake PostgREST Server
+In-memory stand-in for the subset of the Supabase REST API that
+supabase_db.py uses: select with embeds, filters and logic trees, order,
+limit, counts, POST/PATCH/DELETE, Prefer headers and the RPC functions in sql/
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Columns of each table; selecting anything else is an error, as in PostgREST
+SCHEMA = {
+    'role': ['id', 'nom', 'description'],
+    'statut': ['id', 'nom'],
+    'categorie': ['id', 'nom'],
+    'type': ['id', 'nom'],
+    'priorite': ['id', 'nom'],
+    'habilitation': ['id', 'nom', 'categorie'],
+    'role_habilitation': ['id', 'role_id', 'habilitation_id'],
+    'utilisateur': ['id', 'nom_utilisateur', 'email', 'mot_de_passe', 'prenom', 'nom', 'role_id'],
+    'ticket': ['id', 'titre', 'description', 'date_creation', 'date_mise_a_jour', 'date_cloture', 'statut_id',
+               'priorite_id', 'categorie_id', 'type_id', 'idutilisateur', 'assigned_role_id',
+               'required_habilitation_id', 'resolution_due_at', 'resolution_attempts', 'idempotency_key'],
+    'fichier': ['id', 'ticket_id', 'nom', 'storage_key', 'sha256', 'size_bytes', 'content_type', 'fichier'],
+}
+
+# Embeddable relations: table -> name -> (kind, foreign key column, target table)
+RELATIONS = {
+    'ticket': {
+        'statut': ('one', 'statut_id', 'statut'),
+        'utilisateur': ('one', 'idutilisateur', 'utilisateur'),
+        'categorie': ('one', 'categorie_id', 'categorie'),
+        'type': ('one', 'type_id', 'type'),
+        'priorite': ('one', 'priorite_id', 'priorite'),
+        'fichier': ('many', 'ticket_id', 'fichier'),
+    },
+    'utilisateur': {'role': ('one', 'role_id', 'role')},
+    'role_habilitation': {
+        'role': ('one', 'role_id', 'role'),
+        'habilitation': ('one', 'habilitation_id', 'habilitation'),
+    },
+    'fichier': {'ticket': ('one', 'ticket_id', 'ticket')},
+}
+
+# Computed columns (PostgreSQL functions taking the row)
+COMPUTED = {
+    ('ticket', 'description_excerpt'): lambda row: (row.get('description') or '')[:121],
+}
+
+
+class PostgrestError(Exception):
+    def __init__(self, status, message, code=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.code = code
+
+
+def _split_top(text, sep=','):
+    """Split text on sep outside parentheses and double quotes"""
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == sep and depth == 0 and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+def _coerce(raw, sample):
+    """Filter value raw, typed like the column value sample"""
+    raw = raw[1:-1] if len(raw) >= 2 and raw[0] == raw[-1] == '"' else raw
+    if isinstance(sample, bool):
+        return raw == 'true'
+    if isinstance(sample, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def _compare(op, value, raw):
+    if op == 'is':
+        target = {'null': None, 'true': True, 'false': False}.get(raw, raw)
+        return value is target
+    if op == 'in':
+        items = [_coerce(v, value) for v in _split_top(raw.strip('()'))]
+        return value is not None and value in items
+    if value is None:
+        return False
+    target = _coerce(raw, value)
+    try:
+        if op == 'eq':
+            return value == target
+        if op == 'neq':
+            return value != target
+        if op == 'lt':
+            return value < target
+        if op == 'lte':
+            return value <= target
+        if op == 'gt':
+            return value > target
+        if op == 'gte':
+            return value >= target
+    except TypeError:
+        return False
+    raise PostgrestError(400, f"unknown operator {op}", 'PGRST100')
+
+
+def _condition(column, expr):
+    """Predicate for column filtered by expr ("eq.1", "not.is.null", "in.(1,2)")"""
+    negate = expr.startswith('not.')
+    if negate:
+        expr = expr[4:]
+    op, _, raw = expr.partition('.')
+
+    def predicate(row):
+        result = _compare(op, row.get(column), raw)
+        return not result if negate else result
+    return predicate
+
+
+def _logic_tree(kind, body):
+    """Predicate for an and(...)/or(...) logic tree body"""
+    predicates = []
+    for item in _split_top(body):
+        for nested in ('and', 'or', 'not.and', 'not.or'):
+            if item.startswith(nested + '('):
+                inner = _logic_tree(nested.replace('not.', ''), item[len(nested) + 1:-1])
+                predicates.append((lambda p: lambda row: not p(row))(inner) if nested.startswith('not.') else inner)
+                break
+        else:
+            column, _, expr = item.partition('.')
+            predicates.append(_condition(column, expr))
+    if kind == 'and':
+        return lambda row: all(p(row) for p in predicates)
+    return lambda row: any(p(row) for p in predicates)
+
+
+class FakePostgrest:
+    """In-memory tables and the request semantics of PostgREST"""
+
+    def __init__(self, tables):
+        self.tables = {name: [dict(row) for row in tables.get(name, [])] for name in SCHEMA}
+        self._by_id = {name: {row['id']: row for row in rows} for name, rows in self.tables.items()}
+        self._next_id = {name: max(ids, default=0) + 1 for name, ids in self._by_id.items()}
+        self.lock = threading.RLock()
+        self.requests = 0
+        self.bytes_sent = 0
+
+    # ---- query parsing ----
+    def _filters(self, table, params):
+        predicates, id_eq = [], None
+        for key, value in params:
+            if key in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns'):
+                continue
+            if key in ('and', 'or'):
+                predicates.append(_logic_tree(key, value[1:-1]))
+                continue
+            if key not in SCHEMA[table]:
+                raise PostgrestError(400, f"column {table}.{key} does not exist", '42703')
+            if key == 'id' and value.startswith('eq.'):
+                id_eq = _coerce(value[3:], 0)
+            predicates.append(_condition(key, value))
+        return predicates, id_eq
+
+    def _rows(self, table, params):
+        predicates, id_eq = self._filters(table, params)
+        if id_eq is not None:
+            row = self._by_id[table].get(id_eq)
+            candidates = [row] if row else []
+        else:
+            candidates = self.tables[table]
+        return [row for row in candidates if all(p(row) for p in predicates)]
+
+    def _order(self, rows, spec):
+        for term in reversed(spec.split(',')):
+            parts = term.split('.')
+            column, descending = parts[0], 'desc' in parts[1:]
+            # Nulls sort last ascending and first descending, as in PostgreSQL
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=descending)
+        return rows
+
+    def _project(self, table, rows, select):
+        items = _split_top(select or '*')
+        plan = []
+        for item in items:
+            alias, _, source = item.partition(':') if ':' in item.split('(')[0] else ('', '', item)
+            if '(' in source:
+                rel, sub = source[:-1].split('(', 1)
+                if rel not in RELATIONS.get(table, {}):
+                    raise PostgrestError(400, f"Could not find a relationship between '{table}' and '{rel}'",
+                                         'PGRST200')
+                plan.append(('embed', alias or rel, rel, sub))
+            elif source == '*':
+                plan.extend(('column', c, c, None) for c in SCHEMA[table])
+            elif source in SCHEMA[table]:
+                plan.append(('column', alias or source, source, None))
+            elif (table, source) in COMPUTED:
+                plan.append(('computed', alias or source, source, None))
+            else:
+                raise PostgrestError(400, f"column {table}.{source} does not exist", '42703')
+
+        many = {}
+        for kind, _, rel, _ in plan:
+            if kind == 'embed' and RELATIONS[table][rel][0] == 'many':
+                _, fk, target = RELATIONS[table][rel]
+                index = many[rel] = {}
+                for child in self.tables[target]:
+                    index.setdefault(child.get(fk), []).append(child)
+
+        result = []
+        for row in rows:
+            out = {}
+            for kind, name, source, sub in plan:
+                if kind == 'column':
+                    out[name] = row.get(source)
+                elif kind == 'computed':
+                    out[name] = COMPUTED[(table, source)](row)
+                else:
+                    rel_kind, fk, target = RELATIONS[table][source]
+                    if rel_kind == 'one':
+                        parent = self._by_id[target].get(row.get(fk))
+                        out[name] = self._project(target, [parent], sub)[0] if parent else None
+                    else:
+                        out[name] = self._project(target, many[source].get(row['id'], []), sub)
+            result.append(out)
+        return result
+
+    # ---- operations ----
+    def select(self, table, params, project=True):
+        rows = self._rows(table, params)
+        total = len(rows)
+        query = dict(params)
+        if 'order' in query:
+            rows = self._order(list(rows), query['order'])
+        offset = int(query.get('offset', 0))
+        if 'limit' in query:
+            rows = rows[offset:offset + int(query['limit'])]
+        elif offset:
+            rows = rows[offset:]
+        if not project:
+            return rows, total, offset
+        return self._project(table, rows, query.get('select')), total, offset
+
+    def insert(self, table, body):
+        created = []
+        for values in body if isinstance(body, list) else [body]:
+            unknown = set(values) - set(SCHEMA[table])
+            if unknown:
+                raise PostgrestError(400, f"Could not find the '{unknown.pop()}' column of '{table}'", 'PGRST204')
+            row = {column: None for column in SCHEMA[table]}
+            row.update(values)
+            row['id'] = values.get('id') or self._next_id[table]
+            self._next_id[table] = max(self._next_id[table], row['id']) + 1
+            self.tables[table].append(row)
+            self._by_id[table][row['id']] = row
+            created.append(row)
+        return created
+
+    def update(self, table, params, body):
+        rows = self._rows(table, params)
+        for row in rows:
+            row.update(body)
+        return rows
+
+    def delete(self, table, params):
+        rows = self._rows(table, params)
+        doomed = {id(row) for row in rows}
+        self.tables[table] = [row for row in self.tables[table] if id(row) not in doomed]
+        for row in rows:
+            self._by_id[table].pop(row['id'], None)
+        return rows
+
+    def rpc(self, name, args):
+        tickets = self.tables['ticket']
+        if name == 'create_ticket':
+            values = dict(args['new_ticket'])
+            key = values.get('idempotency_key')
+            existing = [t for t in tickets if key and t['idempotency_key'] == key]
+            if existing:
+                return existing
+            values.setdefault('date_creation', datetime.now().isoformat())
+            ticket = self.insert('ticket', {k: v for k, v in values.items() if k in SCHEMA['ticket']})[0]
+            if args.get('attachment'):
+                self.insert('fichier', dict(args['attachment'], ticket_id=ticket['id']))
+            return [ticket]
+        if name == 'start_ticket_resolution':
+            row = self._by_id['ticket'].get(args['ticket_id'])
+            habs = args.get('habilitation_ids')
+            if (not row or row['statut_id'] not in args['from_status_ids'] or row['required_habilitation_id'] is None
+                    or (habs is not None and row['required_habilitation_id'] not in habs)):
+                return []
+            row.update(statut_id=args['to_status_id'], date_mise_a_jour=datetime.now().isoformat(),
+                       resolution_due_at=args['due_at'], resolution_attempts=(row['resolution_attempts'] or 0) + 1)
+            return [row]
+        if name == 'refuse_ticket_resolution':
+            row = self._by_id['ticket'].get(args['ticket_id'])
+            if not row or row['idutilisateur'] != args['owner_id'] or row['statut_id'] not in args['from_status_ids']:
+                return []
+            row.update(statut_id=args['to_status_id'], titre=f"{row['titre'] or ''} {args['title_suffix']}".strip(),
+                       resolution_due_at=None, required_habilitation_id=None,
+                       assigned_role_id=args.get('reassign_role_id'))
+            return [row]
+        raise PostgrestError(404, f"Could not find the function public.{name}", 'PGRST202')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakePostgREST"
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # keep-alive response waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = b'' if body is None else json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+        store = self.server.store
+        with store.lock:
+            store.requests += 1
+            store.bytes_sent += len(data) if self.command != 'HEAD' else 0
+
+    def _handle(self):
+        store = self.server.store
+        url = urlsplit(self.path)
+        if not url.path.startswith('/rest/v1/'):
+            return self._send(404, {'message': 'not found'})
+        name = url.path[len('/rest/v1/'):]
+        params = parse_qsl(url.query, keep_blank_values=True)
+        prefer = self.headers.get('Prefer', '')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        try:
+            with store.lock:
+                if name.startswith('rpc/'):
+                    return self._send(200, store.rpc(name[4:], body or {}))
+                if name not in SCHEMA:
+                    raise PostgrestError(404, f"relation public.{name} does not exist", '42P01')
+                select = dict(params).get('select')
+                if self.command in ('GET', 'HEAD'):
+                    rows, total, offset = store.select(name, params, project=self.command == 'GET')
+                    headers = {}
+                    if 'count=' in prefer:
+                        shown = f"{offset}-{offset + len(rows) - 1}" if rows else '*'
+                        headers['Content-Range'] = f"{shown}/{total}"
+                    return self._send(200, rows, headers)
+                if self.command == 'POST':
+                    rows = store.insert(name, body)
+                    status = 201
+                elif self.command == 'PATCH':
+                    rows = store.update(name, params, body or {})
+                    status = 200
+                else:
+                    rows = store.delete(name, params)
+                    status = 200
+                if 'return=representation' not in prefer:
+                    return self._send(204 if status == 200 else 201)
+                return self._send(status, store._project(name, rows, select))
+        except PostgrestError as e:
+            return self._send(e.status, {'code': e.code, 'message': e.message})
+        except (ValueError, KeyError, TypeError) as e:
+            return self._send(400, {'code': 'PGRST100', 'message': str(e)})
+
+    do_GET = do_HEAD = do_POST = do_PATCH = do_DELETE = _handle
+
+
+def start_server(tables, host='127.0.0.1', port=0, latency=0.0):
+    """Serve tables from a daemon thread; returns the server (server.store holds the data).
+
+    latency seconds are added to every request, to stand in for the network
+    round trip to a hosted Supabase project.
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.store = FakePostgrest(tables)
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-postgrest").start()
+    return server
+
+
+if __name__ == '__main__':
+    from datagen import generate
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--data', help="JSON file from datagen.py (default: generate)")
+    parser.add_argument('--tickets', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request")
+    args = parser.parse_args()
+    if args.data:
+        with open(args.data) as f:
+            tables = json.load(f)
+    else:
+        tables = generate(args.tickets, args.users)
+    server = start_server(tables, port=args.port, latency=args.latency)
+    print(f"Fake PostgREST on http://127.0.0.1:{args.port} "
+          f"(SUPABASE_URL=http://127.0.0.1:{args.port} SUPABASE_KEY=any)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Load Simulator
+Scripted sessions of requesters and N1-N4 agents hitting the app over HTTP
+concurrently, against the fake PostgREST server.
+
+    python bench/load_simulator.py [--requesters 2000] [--agents 200] [--concurrency 50] [--duration 60]
+
+Each virtual user logs in once and then loops over its role's script:
+requesters look at their dashboard, create tickets and validate or refuse
+resolved ones; N1 qualifies tickets, N3/N4 resolve or escalate them through
+resoudre_tickets; N2 browses gestion_tickets and gestion_utilisateurs.
+--concurrency worker threads take turns driving the users, so the app sees
+at most that many requests in flight.
+
+Throughput, latency percentiles, error and conflict rates are printed every
+--interval seconds and per action at the end. Conflicts are actions the app
+refused (flashed as 'error'), typically two agents racing for the same
+ticket; errors are 5xx answers, failed connections and lost sessions.
+"""
+
+import argparse
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from werkzeug.serving import make_server
+
+from datagen import generate
+from run_benchmarks import percentile, start_app
+
+AGENT_MIX = (('N1', 60), ('N3', 25), ('N4', 15))
+VALIDATE_LINK = re.compile(r'/tickets/(\d+)/valider')
+QUALIFY_LINK = re.compile(r'/tickets/(\d+)/qualifier')
+RESOLVE_LINK = re.compile(r'/tickets/(\d+)/resoudre')
+ESCALATE_LINK = re.compile(r'/tickets/(\d+)/escalader')
+IDEMPOTENCY_KEY = re.compile(r'name="idempotency_key" value="([0-9a-f]+)"')
+
+
+class Recorder:
+    """Timed outcomes of every action, with periodic and final reports"""
+
+    def __init__(self):
+        self.samples = []  # (finished_at, action, seconds, outcome)
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def record(self, action, seconds, outcome):
+        with self.lock:
+            self.samples.append((time.perf_counter(), action, seconds, outcome))
+
+    def window(self, since):
+        with self.lock:
+            return [s for s in self.samples if s[0] >= since]
+
+    @staticmethod
+    def describe(samples, seconds):
+        latencies = [s[2] * 1000 for s in samples]
+        errors = sum(1 for s in samples if s[3] == 'error')
+        conflicts = sum(1 for s in samples if s[3] == 'conflict')
+        return (f"{len(samples) / seconds:8.1f} req/s  p50 {percentile(latencies, 50):7.1f}  "
+                f"p95 {percentile(latencies, 95):7.1f}  p99 {percentile(latencies, 99):7.1f} ms  "
+                f"errors {errors / len(samples):6.2%}  conflicts {conflicts / len(samples):6.2%}")
+
+
+class VirtualUser:
+    """One account with its own cookie jar, driven by one worker at a time"""
+
+    def __init__(self, base_url, username, role, session_serializer, habilitation_ids):
+        self.base_url = base_url
+        self.username = username
+        self.role = role
+        self.http = requests.Session()
+        self.logged_in = False
+        self.session_serializer = session_serializer
+        self.habilitation_ids = habilitation_ids
+
+    def call(self, recorder, action, method, path, data=None):
+        """Send one request and record its outcome; returns the response body, None on error"""
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, data=data, allow_redirects=False, timeout=60)
+            outcome = 'ok'
+            if response.status_code >= 500:
+                outcome = 'error'
+            elif response.status_code == 302 and response.headers.get('Location', '').endswith('/login'):
+                outcome = 'error'  # session lost or role refused
+                self.logged_in = False
+            elif method == 'POST' and self.last_flash_category(response) == 'error':
+                outcome = 'conflict'
+            body = response.text
+        except requests.RequestException:
+            outcome, body = 'error', None
+        recorder.record(action, time.perf_counter() - started, outcome)
+        return body if outcome != 'error' else None
+
+    def last_flash_category(self, response):
+        """Category of the message the app flashed in response (read from the signed session cookie)"""
+        cookie = response.cookies.get('session')
+        if not cookie:
+            return None
+        try:
+            flashes = self.session_serializer.loads(cookie).get('_flashes') or []
+        except Exception:
+            return None
+        return flashes[-1][0] if flashes else None
+
+    def step(self, recorder, rng):
+        if not self.logged_in:
+            body = self.call(recorder, 'login', 'POST', '/login',
+                             {'username': self.username, 'password': 'password'})
+            self.logged_in = body is not None
+            return
+        getattr(self, f"step_{self.role}")(recorder, rng)
+
+    def step_initial(self, recorder, rng):
+        page = self.call(recorder, 'requester.dashboard', 'GET', '/dashboard-initial')
+        resolved = VALIDATE_LINK.findall(page or '')
+        if resolved and rng.random() < 0.5:
+            ticket_id = rng.choice(resolved)
+            if rng.random() < 0.8:
+                self.call(recorder, 'requester.validate', 'POST', f"/tickets/{ticket_id}/valider")
+            else:
+                self.call(recorder, 'requester.refuse', 'POST', f"/tickets/{ticket_id}/refuser")
+        elif rng.random() < 0.4:
+            form = self.call(recorder, 'requester.new_ticket_form', 'GET', '/ajouter-ticket')
+            key = IDEMPOTENCY_KEY.search(form or '')
+            if key:
+                self.call(recorder, 'requester.create_ticket', 'POST', '/ajouter-ticket', {
+                    'idempotency_key': key.group(1), 'titre': f"Panne {rng.randint(1, 99999)}",
+                    'description': "Créé par le simulateur de charge", 'categorie': str(rng.randint(1, 8)),
+                    'type': str(rng.randint(1, 5)),
+                })
+
+    def step_N1(self, recorder, rng):
+        page = self.call(recorder, 'N1.queue', 'GET', '/resoudre-tickets')
+        unqualified = QUALIFY_LINK.findall(page or '')
+        qualified = ESCALATE_LINK.findall(page or '')
+        if unqualified and rng.random() < 0.8:
+            self.call(recorder, 'N1.qualify', 'POST', f"/tickets/{rng.choice(unqualified)}/qualifier",
+                      {'habilitation_id': str(rng.choice(self.habilitation_ids))})
+        elif qualified:
+            self.call(recorder, 'N1.escalate', 'POST', f"/tickets/{rng.choice(qualified)}/escalader")
+
+    def step_agent(self, recorder, rng):
+        page = self.call(recorder, f"{self.role}.queue", 'GET', '/resoudre-tickets')
+        resolvable = RESOLVE_LINK.findall(page or '')
+        escalatable = ESCALATE_LINK.findall(page or '')
+        if resolvable and (not escalatable or rng.random() < 0.7):
+            self.call(recorder, f"{self.role}.resolve", 'POST', f"/tickets/{rng.choice(resolvable)}/resoudre")
+        elif escalatable:
+            self.call(recorder, f"{self.role}.escalate", 'POST', f"/tickets/{rng.choice(escalatable)}/escalader")
+
+    step_N3 = step_agent
+    step_N4 = step_agent
+
+    def step_N2(self, recorder, rng):
+        if rng.random() < 0.2:
+            self.call(recorder, 'N2.users', 'GET', '/gestion-utilisateurs')
+            return
+        query = rng.choice(['', '?statut=1', '?statut=2&role=2', f"?categorie={rng.randint(1, 8)}"])
+        self.call(recorder, 'N2.tickets', 'GET', f"/gestion-tickets{query}")
+
+
+def build_population(tables, requesters, agents, admins):
+    """Give the generated accounts the requested role mix; returns [(username, role)]"""
+    role_ids = {r['nom']: r['id'] for r in tables['role']}
+    roles = ['N2'] * admins
+    for role, weight in AGENT_MIX:
+        roles += [role] * round(agents * weight / 100)
+    roles += ['initial'] * requesters
+    population = []
+    for user, role in zip(tables['utilisateur'], roles):
+        user['role_id'] = role_ids[role]
+        population.append((user['nom_utilisateur'], role))
+    return population
+
+
+def worker(users, recorder, stop, think, seed):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        try:
+            user = users.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        try:
+            user.step(recorder, rng)
+        finally:
+            users.put(user)
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent requesters and agents against the app")
+    parser.add_argument('--requesters', type=int, default=2000)
+    parser.add_argument('--agents', type=int, default=200, help="N1/N3/N4 agents, split 60/25/15")
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--tickets', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight at most")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds of load")
+    parser.add_argument('--think', type=float, default=0.0, help="Mean pause between two steps of a worker (s)")
+    parser.add_argument('--interval', type=float, default=5, help="Seconds between progress lines")
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    tables = generate(args.tickets, args.requesters + args.agents + args.admins, seed=args.seed)
+    population = build_population(tables, args.requesters, args.agents, args.admins)
+    backend, app = start_app(tables)
+    habilitation_ids = [h['id'] for h in tables['habilitation']]
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name="app-server").start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    serializer = app.session_interface.get_signing_serializer(app)
+
+    users = queue.Queue()
+    rng = random.Random(args.seed)
+    for username, role in rng.sample(population, len(population)):
+        users.put(VirtualUser(base_url, username, role, serializer, habilitation_ids))
+
+    print(f"{len(population)} users ({args.requesters} requesters, {args.agents} agents, {args.admins} admins), "
+          f"{args.concurrency} workers, {args.duration:g}s against {base_url}")
+    recorder = Recorder()
+    stop = threading.Event()
+    workers = [threading.Thread(target=worker, args=(users, recorder, stop, args.think, args.seed + i), daemon=True)
+               for i in range(args.concurrency)]
+    for t in workers:
+        t.start()
+
+    deadline = recorder.started + args.duration
+    window_start = recorder.started
+    while window_start < deadline:
+        time.sleep(max(0.0, min(args.interval, deadline - window_start)))
+        now = time.perf_counter()
+        samples = recorder.window(window_start)
+        if samples:
+            print(f"[{now - recorder.started:6.1f}s] {Recorder.describe(samples, now - window_start)}")
+        window_start = now
+
+    stop.set()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - recorder.started
+    server.shutdown()
+    backend.shutdown()
+
+    by_action = defaultdict(list)
+    for sample in recorder.samples:
+        by_action[sample[1]].append(sample)
+    print(f"\n{'action':26} {'count':>7}")
+    for action in sorted(by_action):
+        print(f"{action:26} {len(by_action[action]):7d} {Recorder.describe(by_action[action], elapsed)}")
+    if not recorder.samples:
+        print("No request completed")
+        return 1
+    print(f"{'total':26} {len(recorder.samples):7d} {Recorder.describe(recorder.samples, elapsed)}")
+
+    error_rate = sum(1 for s in recorder.samples if s[3] == 'error') / len(recorder.samples)
+    if error_rate > args.max_error_rate:
+        print(f"Error rate {error_rate:.2%} above {args.max_error_rate:.2%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Route Benchmarks
+Drives every Flask route of app.py through the test client against the fake
+PostgREST server and checks each route's backend round trips against its
+budget.
+
+    python bench/run_benchmarks.py [--tickets 100000] [--users 5000] [--iterations 20]
+
+Reports p50/p99 latency, backend calls and bytes per request, and exits
+with status 1 when a route makes more backend calls than its budget or
+answers with a server error. Calls and bytes are counted by the fake
+server, so the queries of streamed pages are included. Latencies include
+the fake server's own work and are only comparable between runs.
+
+Streamed pages are also checked to show a flashed message exactly once.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from datagen import FIXED_USERS, generate  # noqa: E402
+from fake_postgrest import start_server  # noqa: E402
+
+# Fixed accounts from datagen: role -> user id
+USER_IDS = {role: i for i, (_, role) in enumerate(FIXED_USERS, 1)}
+
+
+class Scenario:
+    """One request to benchmark, as a logged-in role, with its backend call budget"""
+
+    def __init__(self, name, path, budget, role='N2', method='GET', data=None, headers=None):
+        self.name = name
+        self.path = path
+        self.budget = budget
+        self.role = role
+        self.method = method
+        self.data = data
+        self.headers = headers
+
+
+# Warm-cache round-trip budgets; reference data, users and the permission
+# matrix are served from the cache once loaded
+SCENARIOS = [
+    Scenario('login (GET)', '/login', 0, role=None),
+    Scenario('dashboard_initial', '/dashboard-initial', 0, role='initial'),
+    Scenario('dashboard_admin', '/dashboard-admin', 0),
+    Scenario('dashboard_n1', '/dashboard-n1', 0, role='N1'),
+    Scenario('dashboard_n3', '/dashboard-n3', 0, role='N3'),
+    Scenario('dashboard_n4', '/dashboard-n4', 0, role='N4'),
+    Scenario('resoudre_tickets (N1)', '/resoudre-tickets', 1, role='N1'),
+    Scenario('resoudre_tickets (N3)', '/resoudre-tickets', 1, role='N3'),
+    Scenario('resoudre_tickets (filtered)', '/resoudre-tickets?statut=2&categorie=3', 1, role='N4'),
+    Scenario('gestion_tickets', '/gestion-tickets', 1),
+    Scenario('gestion_tickets (filtered)', '/gestion-tickets?statut=5&role=2&date_debut=2023-03-01', 1),
+    Scenario('ajouter_ticket (GET)', '/ajouter-ticket', 0, role='initial'),
+    Scenario('ajouter_ticket (POST)', '/ajouter-ticket', 1, role='initial', method='POST',
+             data={'titre': 'Bench', 'description': 'Ticket de benchmark', 'categorie': '1', 'type': '1'}),
+    Scenario('ajouter_ticket_admin (GET)', '/ajouter-ticket-admin', 0),
+    Scenario('modifier_ticket (GET)', '/modifier-ticket/42', 1),
+    Scenario('gestion_utilisateurs', '/gestion-utilisateurs', 0),
+    Scenario('modifier_utilisateur (GET)', '/modifier-utilisateur/42', 1),
+    Scenario('gestion_habilitations', '/gestion-habilitations', 0),
+    Scenario('gestion_habilitations_role', '/gestion-habilitations/2', 0),
+    Scenario('qualifier_ticket', '/tickets/7/qualifier', 1, role='N1', method='POST', data={'habilitation_id': '1'}),
+    Scenario('escalader_ticket', '/tickets/8/escalader', 1, role='N3', method='POST'),
+    Scenario('resoudre_ticket', '/tickets/9/resoudre', 1, role='N4', method='POST'),
+    Scenario('valider_ticket', '/tickets/10/valider', 1, role='initial', method='POST'),
+    Scenario('refuser_ticket', '/tickets/11/refuser', 1, role='initial', method='POST'),
+    Scenario('supprimer_utilisateur', '/supprimer-utilisateur/4999', 2, method='POST'),
+    Scenario('metrics', '/metrics', 0, role=None, headers={'Authorization': 'Bearer bench'}),
+]
+
+# Streamed pages that display flashed messages
+FLASH_PAGES = ['/gestion-tickets', '/gestion-utilisateurs']
+
+def backend_env(server, workdir):
+    """Environment pointing the app at server, with its files under workdir"""
+    return {
+        'SUPABASE_URL': f"http://127.0.0.1:{server.server_address[1]}",
+        'SUPABASE_KEY': 'bench',
+        'ATTACHMENTS_DIR': os.path.join(workdir, 'attachments'),
+        'LEADER_LOCK_PATH': os.path.join(workdir, 'leader.lock'),
+        'SUPABASE_SNAPSHOT_PATH': os.path.join(workdir, 'reference.json'),
+        'METRICS_TOKEN': 'bench',
+    }
+
+
+def start_app(tables):
+    """Serve tables from a fake PostgREST server and import the Flask app against it.
+
+    Returns (server, app); app.py can only be imported once per process.
+    """
+    server = start_server(tables)
+    os.environ.update(backend_env(server, tempfile.mkdtemp(prefix="digitickets-bench-")))
+
+    import app  # noqa: E402
+
+    # Background jobs start with the first request; start them now and let
+    # their first round of backend calls end, so no route is charged for it
+    app.start_resolution_watcher()
+    wait_until_idle(server.store)
+    return server, app.app
+
+
+def wait_until_idle(store, quiet=0.5, timeout=10):
+    """Wait until the fake server has had no request for quiet seconds"""
+    deadline = time.monotonic() + timeout
+    last = None
+    while time.monotonic() < deadline:
+        with store.lock:
+            count = store.requests
+        if count == last:
+            return
+        last = count
+        time.sleep(quiet)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_scenario(client, store, scenario, iterations, warmup):
+    with client.session_transaction() as session:
+        session.clear()
+        if scenario.role:
+            session['user_id'] = USER_IDS[scenario.role]
+            session['user_role'] = scenario.role
+            session['user_nom'] = f"bench-{scenario.role}"
+
+    latencies, calls, sizes, statuses = [], [], [], set()
+    for i in range(warmup + iterations):
+        with store.lock:
+            requests_before, bytes_before = store.requests, store.bytes_sent
+        started = time.perf_counter()
+        response = client.open(scenario.path, method=scenario.method, data=scenario.data, headers=scenario.headers)
+        response.get_data()  # streamed pages query the backend while the body is read
+        response.close()
+        elapsed = time.perf_counter() - started
+        if i < warmup:
+            continue
+        with store.lock:
+            calls.append(store.requests - requests_before)
+            sizes.append(store.bytes_sent - bytes_before)
+        latencies.append(elapsed * 1000)
+        statuses.add(response.status_code)
+
+    return {
+        'p50': statistics.median(latencies),
+        'p99': percentile(latencies, 99),
+        'calls': max(calls),
+        'bytes': statistics.mean(sizes),
+        'statuses': statuses,
+    }
+
+
+def check_flash_shown_once(client, path):
+    """Whether a message flashed before loading path shows on the first load only"""
+    message = f"Message de test pour {path}"
+    with client.session_transaction() as session:
+        session.clear()
+        session['user_id'] = USER_IDS['N2']
+        session['user_role'] = 'N2'
+        session['user_nom'] = 'bench-N2'
+        session['_flashes'] = [('success', message)]
+    shown = [message in client.get(path).get_data(as_text=True) for _ in range(2)]
+    return shown == [True, False]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Flask routes against the fake PostgREST server")
+    parser.add_argument('--tickets', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--only', help="Only run scenarios whose name contains this text")
+    args = parser.parse_args()
+
+    print(f"Generating {args.tickets} tickets and {args.users} users...")
+    server, app = start_app(generate(args.tickets, args.users))
+    client = app.test_client()
+    scenarios = [s for s in SCENARIOS if not args.only or args.only in s.name]
+    failures = []
+    print(f"{'route':32} {'p50 ms':>8} {'p99 ms':>8} {'calls':>6} {'budget':>6} {'KB/req':>8}  status")
+    for scenario in scenarios:
+        result = run_scenario(client, server.store, scenario, args.iterations, args.warmup)
+        over_budget = result['calls'] > scenario.budget
+        server_error = any(status >= 500 for status in result['statuses'])
+        verdict = 'OVER BUDGET' if over_budget else 'ERROR' if server_error else 'ok'
+        if verdict != 'ok':
+            failures.append(scenario.name)
+        print(f"{scenario.name:32} {result['p50']:8.1f} {result['p99']:8.1f} {result['calls']:6d} "
+              f"{scenario.budget:6d} {result['bytes'] / 1024:8.1f}  {verdict} "
+              f"{','.join(map(str, sorted(result['statuses'])))}")
+
+    for path in FLASH_PAGES:
+        if not check_flash_shown_once(client, path):
+            print(f"{path}: flashed message not shown exactly once")
+            failures.append(f"{path} (flash)")
+
+    print(f"Fake PostgREST served {server.store.requests} requests, {server.store.bytes_sent / 1024:.0f} KB")
+    server.shutdown()
+    if failures:
+        print(f"{len(failures)} route(s) failed: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+Cache Module
+Bounded, thread-safe LRU cache with per-key TTL, dependency tags,
+single-flight loading and stale-while-revalidate, plus an optional shared
+Redis-protocol backend for multi-worker deployments
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlparse, unquote
+
+# Distinguishes "not cached" from a cached None
+_MISSING = object()
+
+class _Flight:
+    """A load in progress that concurrent callers for the same key wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CacheBackend(ABC):
+    """Interface of the cache backends used by SupabaseDB"""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, key, default=None):
+        """Return a fresh entry, or default"""
+
+    @abstractmethod
+    def set(self, key, value, ttl=None, tags=None):
+        """Store a value with an optional TTL (seconds) and dependency tags"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove a single entry"""
+
+    @abstractmethod
+    def invalidate_tags(self, *tags):
+        """Remove every entry depending on any of tags"""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every entry"""
+
+    @abstractmethod
+    def get_or_load(self, key, loader, ttl=None, tags=None):
+        """Return the cached value for key, storing loader() on a miss"""
+
+    @abstractmethod
+    def get_stats(self):
+        """Counters describing the backend's use"""
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache shared by the request threads and background jobs.
+
+    Entries expire after their TTL. For stale_ttl seconds past expiry an entry
+    may still be returned by get_or_load while a single background refresh
+    runs. Concurrent misses on one key are coalesced into one loader call.
+    Entries can carry dependency tags; invalidate_tags evicts exactly the
+    entries (and in-flight loads) that depend on a tag.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries=1024, default_ttl=300, stale_ttl=0):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._inflight = {}
+        self._tags = {}  # tag -> keys depending on it
+        self._key_tags = {}  # key -> its tags
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def _link(self, key, tags):
+        """Record key as depending on tags (lock held)"""
+        if not tags:
+            return
+        self._key_tags.setdefault(key, set()).update(tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+    def _unlink(self, key):
+        """Forget the tags of key (lock held)"""
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _remove(self, key):
+        """Drop an entry, its in-flight load and its tags (lock held)"""
+        self._data.pop(key, None)
+        self._inflight.pop(key, None)
+        self._unlink(key)
+
+    def _store(self, key, value, ttl, tags=None):
+        """Insert under the lock, evicting least recently used entries"""
+        self._data[key] = (value, time.monotonic() + (self.default_ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        self._link(key, tags)
+        while len(self._data) > self.max_entries:
+            evicted, _ = self._data.popitem(last=False)
+            if evicted not in self._inflight:
+                self._unlink(evicted)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        """Return a fresh entry, or default"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() < entry[1]:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None, tags=None):
+        """Store a value with an optional per-key TTL (seconds) and dependency tags"""
+        with self._lock:
+            self._store(key, value, ttl, tags)
+
+    def delete(self, key):
+        """Remove a single entry"""
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tags(self, *tags):
+        """Remove every entry depending on any of tags"""
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._data.clear()
+            self._inflight.clear()
+            self._tags.clear()
+            self._key_tags.clear()
+
+    def _load(self, key, loader, ttl, flight, tags):
+        """Run loader as the single flight for key and publish the result"""
+        try:
+            flight.value = loader()
+            with self._lock:
+                # An invalidation during the load drops the flight; don't cache then
+                if self._inflight.get(key) is flight:
+                    self._store(key, flight.value, ttl, tags)
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                    if key not in self._data:
+                        self._unlink(key)
+            flight.event.set()
+
+    def get_or_load(self, key, loader, ttl=None, tags=None):
+        """Return the cached value for key, calling loader at most once on a miss.
+
+        Loader exceptions propagate to every waiting caller and nothing is cached.
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if now < expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < expires_at + self.stale_ttl:
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        flight = self._inflight[key] = _Flight()
+                        threading.Thread(target=self._load, args=(key, loader, ttl, flight, tags), daemon=True).start()
+                    return value
+
+            self.misses += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                # Tag the pending key so an invalidation can cancel the load
+                self._link(key, tags)
+
+        if leader:
+            self._load(key, loader, ttl, flight, tags)
+        else:
+            flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def get_stats(self):
+        """Hit, miss, stale and eviction counters"""
+        with self._lock:
+            return {
+                "backend": self.name,
+                "entries": len(self._data),
+                "tags": len(self._tags),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+            }
+
+
+class CacheUnavailable(ConnectionError):
+    """The shared cache server failed recently and is skipped until its retry time"""
+
+
+class _RespConnection:
+    """Minimal Redis protocol (RESP2) client connection over TCP or a Unix socket"""
+
+    def __init__(self, url, timeout=2.0):
+        parsed = urlparse(url)
+        self.url = parsed
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+
+    def connect(self, timeout=-1):
+        """Open the socket, then AUTH and SELECT as the URL requires"""
+        timeout = self.timeout if timeout == -1 else timeout
+        if self.url.scheme == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(unquote(self.url.path))
+        else:
+            sock = socket.create_connection((self.url.hostname or "127.0.0.1", self.url.port or 6379), self.timeout)
+        sock.settimeout(timeout)
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+        if self.url.password:
+            self.command("AUTH", unquote(self.url.password))
+        db = self.url.path.lstrip("/") if self.url.scheme != "unix" else ""
+        if db:
+            self.command("SELECT", db)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._reader = None
+
+    def send(self, *args):
+        """Send one command without reading its reply"""
+        if self._sock is None:
+            self.connect()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        try:
+            self._sock.sendall(b"".join(parts))
+        except OSError:
+            self.close()
+            raise
+
+    def read_reply(self):
+        """Read and decode one reply"""
+        try:
+            line = self._reader.readline()
+        except OSError:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise ConnectionError("Cache server closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        self.close()
+        raise ConnectionError(f"Unexpected reply from cache server: {line!r}")
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read_reply()
+
+
+class RedisCacheBackend(CacheBackend):
+    """Shared cache store speaking the Redis protocol, on TCP or a Unix socket.
+
+    Values are stored as JSON under prefix + key with a millisecond TTL; each
+    tag is a set of the keys that depend on it. Invalidations delete the
+    dependent keys and are published on channel so every worker can evict
+    its in-process copies. Loads are not coalesced across workers; SharedCache
+    coalesces them within each worker.
+
+    Commands run on pooled connections, outside any lock. When the server
+    cannot be reached, commands fail fast with CacheUnavailable for a
+    backoff period (1 s, doubling up to max_retry_delay) instead of each
+    waiting for the connection timeout; one caller then probes the server.
+    """
+
+    name = "redis"
+
+    def __init__(self, url, prefix="digitickets:", channel="digitickets:invalidate", timeout=2.0, default_ttl=300,
+                 max_idle=8, max_retry_delay=30):
+        self.url = url
+        self.prefix = prefix
+        self.channel = channel
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.max_idle = max_idle
+        self.max_retry_delay = max_retry_delay
+        self._idle = []
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _checkout(self):
+        """(idle connection or None, whether this call probes a failed server);
+        raises CacheUnavailable while the server is backed off"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._retry_at:
+                raise CacheUnavailable(f"Cache server unavailable, next try in {self._retry_at - now:.0f}s")
+            probe = self._failures > 0
+            if probe:
+                # The others keep skipping the server while this call probes it
+                self._retry_at = now + self.timeout
+            return (self._idle.pop() if self._idle else None), probe
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._failures = 0
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _trip(self, error, probe):
+        with self._lock:
+            if not probe and time.monotonic() < self._retry_at:
+                return  # Already backed off by a concurrent failure
+            self._failures += 1
+            delay = min(2 ** (self._failures - 1), self.max_retry_delay)
+            self._retry_at = time.monotonic() + delay
+        print(f"Cache server unreachable, using local cache only for {delay}s: {error}")
+
+    def _command(self, *args):
+        conn, probe = self._checkout()
+        reused = conn is not None
+        try:
+            if conn is None:
+                conn = _RespConnection(self.url, self.timeout)
+                conn.connect()
+            try:
+                reply = conn.command(*args)
+            except (OSError, ConnectionError):
+                if not reused:
+                    raise
+                # The server may have closed an idle connection: retry once on a new one
+                conn.close()
+                conn.connect()
+                reply = conn.command(*args)
+        except (OSError, ConnectionError) as e:
+            conn.close()
+            self._trip(e, probe)
+            raise
+        except RuntimeError:
+            # Error reply: the connection itself is fine
+            self._checkin(conn)
+            raise
+        self._checkin(conn)
+        return reply
+
+    def get(self, key, default=None):
+        raw = self._command("GET", self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None, tags=None):
+        ttl_ms = max(int((self.default_ttl if ttl is None else ttl) * 1000), 1)
+        self._command("SET", self.prefix + key, json.dumps(value), "PX", ttl_ms)
+        for tag in tags or ():
+            tag_key = f"{self.prefix}tag:{tag}"
+            self._command("SADD", tag_key, key)
+            self._command("PEXPIRE", tag_key, ttl_ms)
+
+    def delete(self, key):
+        self.evictions += self._command("DEL", self.prefix + key) or 0
+
+    def invalidate_tags(self, *tags):
+        """Delete keys depending on tags and broadcast the invalidation"""
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            keys = self._command("SMEMBERS", tag_key) or []
+            if keys:
+                self.evictions += self._command("DEL", *[self.prefix.encode() + k for k in keys]) or 0
+            self._command("DEL", tag_key)
+        self._command("PUBLISH", self.channel, json.dumps({"tags": list(tags)}))
+
+    def clear(self):
+        """Delete every key under prefix and broadcast a full clear"""
+        cursor = "0"
+        while True:
+            cursor, keys = self._command("SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", 500)
+            cursor = cursor.decode() if isinstance(cursor, bytes) else str(cursor)
+            if keys:
+                self.evictions += self._command("DEL", *keys) or 0
+            if cursor == "0":
+                break
+        self._command("PUBLISH", self.channel, json.dumps({"all": True}))
+
+    def get_or_load(self, key, loader, ttl=None, tags=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, ttl, tags)
+        return value
+
+    def subscribe(self, on_message):
+        """Deliver invalidation broadcasts to on_message(tags or None) from a daemon thread"""
+        def _listen():
+            delay = 1
+            while True:
+                conn = _RespConnection(self.url, self.timeout)
+                try:
+                    conn.connect(timeout=None)
+                    conn.command("SUBSCRIBE", self.channel)
+                    delay = 1
+                    while True:
+                        reply = conn.read_reply()
+                        if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                            message = json.loads(reply[2])
+                            on_message(None if message.get("all") else message.get("tags", []))
+                except Exception as e:
+                    print(f"Cache invalidation subscriber error: {e}")
+                    # Anything cached locally may have missed an invalidation
+                    on_message(None)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 30)
+                finally:
+                    conn.close()
+
+        thread = threading.Thread(target=_listen, daemon=True, name="cache-invalidation")
+        thread.start()
+        return thread
+
+    def get_stats(self):
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+
+class SharedCache(CacheBackend):
+    """In-process LRU cache in front of a shared backend.
+
+    Local misses read through to the shared store before calling the loader,
+    so one worker's load warms every worker. Invalidations go to the shared
+    store and come back through its broadcast to evict each worker's local
+    copies. Shared store errors degrade to local-only caching.
+    """
+
+    name = "shared"
+
+    def __init__(self, local, shared, local_ttl=30):
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+        shared.subscribe(self._on_invalidation)
+
+    def _on_invalidation(self, tags):
+        if tags is None:
+            self.local.clear()
+        else:
+            self.local.invalidate_tags(*tags)
+
+    def _shared_call(self, method, *args, default=None):
+        try:
+            return getattr(self.shared, method)(*args)
+        except CacheUnavailable:
+            # Backed off after a failure that was already reported
+            self.shared.errors += 1
+            return default
+        except Exception as e:
+            self.shared.errors += 1
+            print(f"Shared cache {method} failed: {e}")
+            return default
+
+    def _local_ttl(self, ttl):
+        ttl = self.local.default_ttl if ttl is None else ttl
+        return min(ttl, self.local_ttl)
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._shared_call("get", key, _MISSING, default=_MISSING)
+            if value is _MISSING:
+                return default
+        return value
+
+    def set(self, key, value, ttl=None, tags=None):
+        self.local.set(key, value, self._local_ttl(ttl), tags)
+        self._shared_call("set", key, value, self.local.default_ttl if ttl is None else ttl, tags)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self._shared_call("delete", key)
+
+    def invalidate_tags(self, *tags):
+        self.local.invalidate_tags(*tags)
+        self._shared_call("invalidate_tags", *tags)
+
+    def clear(self):
+        self.local.clear()
+        self._shared_call("clear")
+
+    def get_or_load(self, key, loader, ttl=None, tags=None):
+        def load_through():
+            value = self._shared_call("get", key, _MISSING, default=_MISSING)
+            if value is _MISSING:
+                value = loader()
+                self._shared_call("set", key, value, self.local.default_ttl if ttl is None else ttl, tags)
+            return value
+
+        return self.local.get_or_load(key, load_through, self._local_ttl(ttl), tags)
+
+    def get_stats(self):
+        return {
+            "backend": self.name,
+            "local": self.local.get_stats(),
+            "shared": self.shared.get_stats(),
+        }
+
+
+def create_cache(max_entries=1024, default_ttl=300, stale_ttl=0):
+    """Build the cache selected by SUPABASE_CACHE_URL.
+
+    Without a URL the cache is in-process only. redis://host:port/db and
+    unix:///path/to/socket select a shared Redis-protocol store.
+    """
+    local = LRUCache(max_entries=max_entries, default_ttl=default_ttl, stale_ttl=stale_ttl)
+    url = os.environ.get("SUPABASE_CACHE_URL")
+    if not url:
+        return local
+    prefix = os.environ.get("SUPABASE_CACHE_PREFIX", "digitickets:")
+    shared = RedisCacheBackend(url, prefix=prefix, channel=prefix + "invalidate", default_ttl=default_ttl)
+    try:
+        local_ttl = float(os.environ.get("SUPABASE_CACHE_LOCAL_TTL", "30"))
+    except ValueError:
+        local_ttl = 30.0
+    return SharedCache(local, shared, local_ttl=local_ttl)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Leader Election Module
+Elects a single process on the host to run background jobs, using an
+exclusive lock on a shared lock file
+"""
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _try_lock(fd):
+    """Take an exclusive non-blocking lock on fd; False if another process holds it"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+class LeaderElection:
+    """Runs registered jobs in exactly one process per lock file.
+
+    Every process polls the lock from a daemon thread. The first one to get
+    it becomes leader and starts the jobs. The OS releases the lock when the
+    leader process exits, however it dies, and another process takes over at
+    its next poll.
+    """
+
+    def __init__(self, lock_path, poll_interval=2.0, name="leader-election"):
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self.name = name
+        self.is_leader = False
+        self._jobs = []
+        self._fd = None
+        self._thread = None
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def add_job(self, start_job):
+        """Register a callable that starts a job once this process is leader"""
+        with self._lock:
+            self._jobs.append(start_job)
+            run_now = self.is_leader
+        if run_now:
+            self._start_job(start_job)
+
+    def start(self):
+        """Start competing for leadership (once)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+            self._thread.start()
+
+    def _start_job(self, start_job):
+        try:
+            start_job()
+        except Exception as e:
+            print(f"{self.name}: failed to start job: {e}")
+
+    def _acquire(self):
+        """Try once to become leader"""
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+        if not _try_lock(fd):
+            os.close(fd)
+            return False
+        # Record the leader's pid for operators; the lock itself is what counts
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self._acquire():
+                    break
+            except OSError as e:
+                print(f"{self.name}: cannot use lock file {self.lock_path}: {e}")
+            time.sleep(self.poll_interval)
+
+        with self._lock:
+            self.is_leader = True
+            jobs = list(self._jobs)
+        print(f"{self.name}: process {os.getpid()} is now leader")
+        for start_job in jobs:
+            self._start_job(start_job)
+
+    def _after_fork(self):
+        """A forked child starts as a follower; the parent keeps any lock it holds"""
+        self._lock = threading.Lock()
+        was_started = self._thread is not None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
+        self._thread = None
+        if was_started:
+            self.start()
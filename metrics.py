@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Metrics Module
+Per-request backend instrumentation (Server-Timing) and aggregated
+histograms, counters and gauges in the Prometheus text format
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Histogram bucket upper bounds for the number of backend calls of a request
+CALL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with a fixed set of labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histogram with fixed buckets and a fixed set of labels.
+
+    Observations only increment one bucket under a lock; buckets are made
+    cumulative when rendered.
+    """
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are read from collect() each time the metrics are rendered.
+
+    collect returns (label values, value) pairs; a failing collect only
+    leaves the gauge without samples.
+    """
+
+    def __init__(self, name, help_text, labels, collect):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = sorted(self.collect())
+        except Exception as e:
+            print(f"Error collecting {self.name}: {e}")
+            samples = []
+        for label_values, value in samples:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def stats_samples(stats, backend=None):
+    """(backend, stat, value) for each number of a get_stats() dict.
+
+    Nested dicts (one per backend of a layered cache) are walked, each
+    number labelled with the 'backend' of the dict holding it.
+    """
+    backend = stats.get('backend', backend)
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from stats_samples(value, backend)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield backend, key, value
+
+
+HTTP_DURATION = Histogram(
+    "digitickets_http_request_duration_seconds", "Time spent handling HTTP requests", ("route", "method"))
+HTTP_REQUESTS = Counter(
+    "digitickets_http_requests_total", "HTTP requests handled", ("route", "method", "status"))
+BACKEND_CALLS_PER_REQUEST = Histogram(
+    "digitickets_backend_calls_per_request", "Supabase round trips made by one HTTP request", ("route",),
+    buckets=CALL_COUNT_BUCKETS)
+BACKEND_DURATION = Histogram(
+    "digitickets_backend_request_duration_seconds", "Latency of Supabase round trips", ("endpoint", "method"))
+BACKEND_RESPONSES = Counter(
+    "digitickets_backend_responses_total", "Supabase responses by status code", ("endpoint", "status"))
+BACKEND_BYTES = Counter(
+    "digitickets_backend_response_bytes_total", "Bytes received from Supabase", ("endpoint",))
+CACHE_LOOKUPS = Counter(
+    "digitickets_cache_lookups_total", "SupabaseDB cache lookups", ("result",))
+
+ALL_METRICS = (HTTP_DURATION, HTTP_REQUESTS, BACKEND_CALLS_PER_REQUEST, BACKEND_DURATION,
+               BACKEND_RESPONSES, BACKEND_BYTES, CACHE_LOOKUPS)
+
+# Gauges added with register_gauge, e.g. by the app for its SupabaseDB
+_gauges = []
+
+
+def register_gauge(gauge):
+    """Render gauge with the other metrics"""
+    _gauges.append(gauge)
+    return gauge
+
+
+class RequestStats:
+    """Backend activity of one HTTP request, shared with its fan-out threads"""
+
+    __slots__ = ('started', 'calls', 'cache_hits', 'cache_misses', '_lock')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = []  # (endpoint, method, status, bytes, seconds)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def add_call(self, endpoint, method, status, size, seconds):
+        with self._lock:
+            self.calls.append((endpoint, method, status, size, seconds))
+
+    def add_cache_lookup(self, hit):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    @property
+    def backend_bytes(self):
+        return sum(call[3] for call in self.calls)
+
+    @property
+    def backend_seconds(self):
+        """Summed latency of the backend calls (concurrent calls overlap)"""
+        return sum(call[4] for call in self.calls)
+
+
+# Stats of the HTTP request being handled; copied into fan-out threads with the context
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def begin_request():
+    """Start collecting backend activity for the current HTTP request"""
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def end_request():
+    """Stop attributing backend activity to an HTTP request"""
+    _current.set(None)
+
+
+def current_request():
+    """RequestStats of the current HTTP request, or None outside requests"""
+    return _current.get()
+
+
+def record_backend_call(endpoint, method, status, size, seconds):
+    """Record one Supabase round trip; status is the HTTP code or 'error'"""
+    BACKEND_DURATION.observe(seconds, endpoint, method)
+    BACKEND_RESPONSES.inc(1, endpoint, str(status))
+    if size:
+        BACKEND_BYTES.inc(size, endpoint)
+    stats = _current.get()
+    if stats is not None:
+        stats.add_call(endpoint, method, status, size, seconds)
+
+
+def record_cache_lookup(hit):
+    """Record a cache hit or miss"""
+    CACHE_LOOKUPS.inc(1, 'hit' if hit else 'miss')
+    stats = _current.get()
+    if stats is not None:
+        stats.add_cache_lookup(hit)
+
+
+def finish_request(stats, route, method, status):
+    """Aggregate a finished HTTP request; returns its Server-Timing header value"""
+    total = time.perf_counter() - stats.started
+    HTTP_DURATION.observe(total, route, method)
+    HTTP_REQUESTS.inc(1, route, method, str(status))
+    BACKEND_CALLS_PER_REQUEST.observe(len(stats.calls), route)
+    return (
+        f'supabase;dur={stats.backend_seconds * 1000:.1f};desc="{len(stats.calls)} calls {stats.backend_bytes} bytes", '
+        f'cache;desc="{stats.cache_hits} hits {stats.cache_misses} misses", '
+        f'total;dur={total * 1000:.1f}'
+    )
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in ALL_METRICS + tuple(_gauges):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
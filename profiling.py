@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Profiling Module
+Profiles a sample of Flask requests (cProfile or a stack sampler) and writes
+per-route profiles and aggregated top-N summaries to a directory
+"""
+
+import cProfile
+import hashlib
+import hmac
+import io
+import itertools
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+# Header carrying "<timestamp>.<hmac>" to force profiling of one request
+PROFILE_HEADER = 'X-Profile'
+
+# Held while a cProfile session runs. From Python 3.12 cProfile hooks
+# sys.monitoring, which is process-wide: a second enable() raises ValueError
+_cprofile_active = threading.Lock()
+
+
+def sign_profile_header(secret, timestamp=None):
+    """Value of the X-Profile header for secret, valid for PROFILE_HEADER_TTL seconds"""
+    timestamp = str(int(timestamp if timestamp is not None else time.time()))
+    signature = hmac.new(secret.encode(), timestamp.encode(), hashlib.sha256).hexdigest()
+    return f"{timestamp}.{signature}"
+
+
+class StackSampler:
+    """Samples the stack of one thread every interval seconds from a daemon thread.
+
+    Stacks are counted in collapsed form ("outer;...;inner"), the input of
+    flame graph tools.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+class RequestProfiler:
+    """Profiles sampled requests of a Flask app.
+
+    A request is profiled with probability sample_rate, or when it carries a
+    valid signed X-Profile header. mode 'cprofile' writes a pstats file per
+    request, one request at a time per process: a request sampled while
+    another is profiled is not profiled. mode 'sample' samples the request
+    thread's stack and keeps collapsed stacks per route. Either way <directory>/<route>/summary.txt
+    holds the top functions aggregated over every sample of the route.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, secret=None, mode='cprofile',
+                 interval=0.005, top=25, header_ttl=300):
+        if mode not in ('cprofile', 'sample'):
+            raise ValueError(f"Unsupported profiling mode: {mode}")
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.mode = mode
+        self.interval = interval
+        self.top = top
+        self.header_ttl = header_ttl
+        self._aggregates = {}  # route -> pstats.Stats or Counter of stacks
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.secret)
+
+    def init_app(self, app):
+        """Register the profiling hooks; nothing is registered when disabled"""
+        if not self.enabled:
+            return
+        from flask import g, request
+
+        @app.before_request
+        def start_profiling():
+            if self.should_profile(request.headers.get(PROFILE_HEADER)):
+                g.profile_session = self.start()
+
+        @app.teardown_request
+        def stop_profiling(exc):
+            session = g.pop('profile_session', None)
+            if session is not None:
+                self.stop(session, request.endpoint or 'unmatched')
+
+    def should_profile(self, header=None):
+        if header and self.secret and self._valid_header(header):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _valid_header(self, header):
+        timestamp, _, signature = header.partition('.')
+        if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > self.header_ttl:
+            return False
+        expected = sign_profile_header(self.secret, timestamp).partition('.')[2]
+        return hmac.compare_digest(signature, expected)
+
+    def start(self):
+        """Start profiling the calling thread; None when a cProfile session is already running"""
+        if self.mode == 'sample':
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+            return sampler
+        if not _cprofile_active.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (not ours) holds the process-wide hook
+            _cprofile_active.release()
+            return None
+        return profiler
+
+    def stop(self, session, route):
+        """Stop a profiling session and write its results under route"""
+        # The session ends before anything can fail, so the next request can be profiled
+        if self.mode == 'sample':
+            stacks = session.stop()
+        else:
+            try:
+                session.disable()
+            finally:
+                _cprofile_active.release()
+        try:
+            route_dir = os.path.join(self.directory, route)
+            os.makedirs(route_dir, mode=0o700, exist_ok=True)
+            if self.mode == 'sample':
+                self._record_stacks(stacks, route, route_dir)
+            else:
+                self._record_pstats(session, route, route_dir)
+        except Exception as e:
+            print(f"Error writing profile for {route}: {e}")
+
+    def _record_pstats(self, profiler, route, route_dir):
+        path = os.path.join(route_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._sequence)}.prof")
+        profiler.dump_stats(path)
+        with self._lock:
+            stats = self._aggregates.get(route)
+            if stats is None:
+                stats = self._aggregates[route] = pstats.Stats(path)
+                stats.samples = 0
+            else:
+                stats.add(path)
+            stats.samples += 1
+            # Only the aggregated numbers are summarized, not the list of merged files
+            stats.files = []
+            out = io.StringIO()
+            stats.stream = out
+            print(f"{route}: {stats.samples} profiled requests", file=out)
+            stats.sort_stats('cumulative').print_stats(self.top)
+            self._write(os.path.join(route_dir, 'summary.txt'), out.getvalue())
+
+    def _record_stacks(self, stacks, route, route_dir):
+        with self._lock:
+            aggregate = self._aggregates.setdefault(route, Counter())
+            aggregate.update(stacks)
+            total = sum(aggregate.values())
+            collapsed = ''.join(f"{stack} {count}\n" for stack, count in aggregate.most_common())
+
+            # Inclusive samples per function (counted once per stack it appears
+            # in) and self samples (function on top of the stack)
+            inclusive = Counter()
+            own = Counter()
+            for stack, count in aggregate.items():
+                frames = stack.split(';')
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    inclusive[frame] += count
+            lines = [f"{route}: {total} samples every {self.interval * 1000:g} ms", "  total     self  function"]
+            lines += [f"{count / total:7.1%}  {own[frame] / total:7.1%}  {frame}"
+                      for frame, count in inclusive.most_common(self.top)]
+            summary = '\n'.join(lines) + '\n'
+
+            self._write(os.path.join(route_dir, 'stacks.collapsed'), collapsed)
+            self._write(os.path.join(route_dir, 'summary.txt'), summary)
+
+    def _write(self, path, text):
+        """Replace path atomically, so readers never see a partial file"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+def create_profiler():
+    """Build the request profiler configured by the PROFILE_* environment variables"""
+    return RequestProfiler(
+        # The code directory is read-only on serverless hosts
+        directory=os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'digitickets-profiles'),
+        sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+        secret=os.environ.get('PROFILE_SECRET') or None,
+        mode=os.environ.get('PROFILE_MODE', 'cprofile'),
+        interval=float(os.environ.get('PROFILE_INTERVAL', 0.005)),
+        top=int(os.environ.get('PROFILE_TOP', 25)),
+        header_ttl=int(os.environ.get('PROFILE_HEADER_TTL', 300)),
+    )
+
+
+if __name__ == '__main__':
+    # Print an X-Profile header value for the configured secret
+    secret = os.environ.get('PROFILE_SECRET')
+    if not secret:
+        sys.exit("PROFILE_SECRET is not set")
+    print(f"{PROFILE_HEADER}: {sign_profile_header(secret)}")
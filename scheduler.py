@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Scheduler Module
+Deadline-driven background scheduler: sleeps until the next deadline instead
+of polling
+"""
+
+import heapq
+import threading
+import time
+
+
+class DeadlineScheduler:
+    """Min-heap of (deadline, key) served by one daemon thread.
+
+    on_due(keys) is called with every key whose deadline (a time.time()
+    timestamp) has passed. Rescheduling a key replaces its deadline. If given,
+    reconcile() is called on start and every reconcile_interval seconds and
+    returns (key, deadline) pairs to (re)schedule, so deadlines set by other
+    processes or missed after a failure are picked up.
+    """
+
+    def __init__(self, on_due, reconcile=None, reconcile_interval=300, name="deadline-scheduler"):
+        self.on_due = on_due
+        self.reconcile = reconcile
+        self.reconcile_interval = reconcile_interval
+        self.name = name
+        self._heap = []
+        self._deadlines = {}  # key -> current deadline; older heap entries are skipped
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._reconcile_now = False
+
+    def schedule(self, key, deadline):
+        """Fire key at deadline (time.time() timestamp), replacing any earlier one"""
+        with self._cond:
+            if self._deadlines.get(key) == deadline:
+                return
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+            # Wake the thread in case this is now the earliest deadline
+            self._cond.notify()
+
+    def enable_reconcile(self, reconcile, reconcile_interval=None):
+        """Start reconciling with reconcile() (immediately, then periodically)"""
+        with self._cond:
+            self.reconcile = reconcile
+            if reconcile_interval is not None:
+                self.reconcile_interval = reconcile_interval
+            self._reconcile_now = True
+            self._cond.notify()
+
+    def cancel(self, key):
+        """Forget the pending deadline of key"""
+        with self._cond:
+            self._deadlines.pop(key, None)
+
+    def pending(self):
+        """Number of keys waiting for their deadline"""
+        with self._cond:
+            return len(self._deadlines)
+
+    def start(self):
+        """Start the scheduler thread (once)"""
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _reconcile(self):
+        try:
+            for key, deadline in self.reconcile():
+                self.schedule(key, deadline)
+        except Exception as e:
+            print(f"{self.name} reconciliation error: {e}")
+
+    def _run(self):
+        next_reconcile = time.monotonic()
+        while True:
+            if self._reconcile_now:
+                self._reconcile_now = False
+                next_reconcile = time.monotonic()
+            if self.reconcile is not None and time.monotonic() >= next_reconcile:
+                self._reconcile()
+                next_reconcile = time.monotonic() + self.reconcile_interval
+
+            due = []
+            with self._cond:
+                if self._stopped:
+                    return
+                if self._reconcile_now:
+                    continue
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, key = heapq.heappop(self._heap)
+                    if self._deadlines.get(key) == deadline:
+                        del self._deadlines[key]
+                        due.append(key)
+                if not due:
+                    timeout = None
+                    if self.reconcile is not None:
+                        timeout = max(next_reconcile - time.monotonic(), 0)
+                    if self._heap:
+                        until_next = max(self._heap[0][0] - now, 0)
+                        timeout = until_next if timeout is None else min(timeout, until_next)
+                    self._cond.wait(timeout)
+                    continue
+
+            try:
+                self.on_due(due)
+            except Exception as e:
+                print(f"{self.name} error: {e}")
@@ -0,0 +1,42 @@
+-- Single-request ticket creation (SupabaseDB.open_ticket).
+-- create_ticket inserts the complete ticket row and its optional attachment
+-- metadata in one transaction. A ticket carries the idempotency key of the
+-- request that created it, so a retried request returns that ticket instead
+-- of creating a duplicate.
+
+alter table public.ticket add column if not exists idempotency_key text;
+
+create unique index if not exists ticket_idempotency_key_idx on public.ticket (idempotency_key);
+
+create or replace function public.create_ticket(new_ticket jsonb, attachment jsonb default null)
+returns setof public.ticket
+language plpgsql
+as $$
+declare
+    created public.ticket;
+begin
+    insert into public.ticket (titre, description, date_creation, idutilisateur, categorie_id, type_id,
+                               statut_id, assigned_role_id, idempotency_key)
+    select r.titre, r.description, coalesce(r.date_creation, now()), r.idutilisateur, r.categorie_id, r.type_id,
+           r.statut_id, r.assigned_role_id, r.idempotency_key
+    from jsonb_populate_record(null::public.ticket, new_ticket) r
+    on conflict (idempotency_key) do nothing
+    returning * into created;
+
+    if created.id is null then
+        -- Retried request: the first attempt already created the ticket
+        return query
+            select * from public.ticket t where t.idempotency_key = new_ticket->>'idempotency_key';
+        return;
+    end if;
+
+    if attachment is not null then
+        insert into public.fichier (ticket_id, nom, storage_key, sha256, size_bytes, content_type)
+        select created.id, a.nom, a.storage_key, a.sha256, a.size_bytes, a.content_type
+        from jsonb_populate_record(null::public.fichier, attachment) a;
+    end if;
+
+    return next created;
+end $$;
+
+notify pgrst, 'reload schema';
@@ -0,0 +1,17 @@
+-- Attachment metadata for the streaming attachment store (attachments.py).
+-- File content now lives in the store, addressed by its SHA-256; the fichier
+-- table only keeps a metadata row per attachment, linked to its ticket.
+
+alter table public.fichier
+    add column if not exists nom text,
+    add column if not exists storage_key text,
+    add column if not exists sha256 char(64),
+    add column if not exists size_bytes bigint,
+    add column if not exists content_type text;
+
+-- Legacy hex-encoded content is no longer written
+alter table public.fichier alter column fichier drop not null;
+
+create index if not exists fichier_ticket_id_idx on public.fichier (ticket_id);
+
+notify pgrst, 'reload schema';
@@ -0,0 +1,17 @@
+-- Foreign key from fichier to ticket, so PostgREST can embed a file's ticket
+-- (access checks on download) and a ticket's files (ticket detail) in one request.
+
+do $$
+begin
+    if not exists (
+        select 1 from pg_constraint
+        where conrelid = 'public.fichier'::regclass and contype = 'f'
+          and confrelid = 'public.ticket'::regclass
+    ) then
+        alter table public.fichier
+            add constraint fichier_ticket_id_fkey
+            foreign key (ticket_id) references public.ticket (id) on delete cascade;
+    end if;
+end $$;
+
+notify pgrst, 'reload schema';
@@ -0,0 +1,16 @@
+-- Computed column used by the list projections in supabase_db.TICKET_PROJECTIONS.
+-- PostgREST exposes it as ticket.description_excerpt, so list views download
+-- at most 121 characters of each description instead of the full text.
+-- One character past the longest template cut (120) is kept so templates can
+-- still tell that the description was truncated and append '...'.
+
+create or replace function public.description_excerpt(public.ticket)
+returns text
+language sql
+stable
+as $$
+    select left($1.description, 121);
+$$;
+
+-- Reload the PostgREST schema cache so the column becomes selectable
+notify pgrst, 'reload schema';
@@ -0,0 +1,53 @@
+-- Ticket workflow transitions that cannot be a plain conditional PATCH
+-- (SupabaseDB.start_ticket_resolution / refuse_ticket_resolution).
+-- Each is a single UPDATE guarded by the expected current status, so the
+-- read-modify-write of resolution_attempts and titre happens inside the
+-- database and concurrent clicks cannot lose an update. They return the
+-- updated ticket, or no row if the ticket could not take the transition.
+
+create or replace function public.start_ticket_resolution(
+    ticket_id bigint,
+    from_status_ids bigint[],
+    to_status_id bigint,
+    due_at timestamp,
+    habilitation_ids bigint[] default null
+)
+returns setof public.ticket
+language sql
+as $$
+    update public.ticket t
+    set statut_id = to_status_id,
+        date_mise_a_jour = now(),
+        resolution_due_at = due_at,
+        resolution_attempts = coalesce(t.resolution_attempts, 0) + 1
+    where t.id = ticket_id
+      and t.statut_id = any(from_status_ids)
+      and t.required_habilitation_id is not null
+      and (habilitation_ids is null or t.required_habilitation_id = any(habilitation_ids))
+    returning t.*;
+$$;
+
+create or replace function public.refuse_ticket_resolution(
+    ticket_id bigint,
+    owner_id bigint,
+    from_status_ids bigint[],
+    to_status_id bigint,
+    title_suffix text,
+    reassign_role_id bigint default null
+)
+returns setof public.ticket
+language sql
+as $$
+    update public.ticket t
+    set statut_id = to_status_id,
+        titre = btrim(coalesce(t.titre, '') || ' ' || title_suffix),
+        resolution_due_at = null,
+        required_habilitation_id = null,
+        assigned_role_id = reassign_role_id
+    where t.id = ticket_id
+      and t.idutilisateur = owner_id
+      and t.statut_id = any(from_status_ids)
+    returning t.*;
+$$;
+
+notify pgrst, 'reload schema';
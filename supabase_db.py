@@ -5,15 +5,385 @@ Provides easy-to-use functions for database operations
 """
 
 import os
+import base64
+import json
+import random
+import stat
+import tempfile
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
 from functools import lru_cache
+from types import MappingProxyType
+from cache import create_cache
+import metrics
+import tracing
+import workflow
 
 # Load environment variables
 load_dotenv()
 
+
+def _env_float(name, default):
+    """Read a float from the environment, falling back to default"""
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return float(default)
+
+
+def _env_int(name, default):
+    """Read an int from the environment, falling back to default"""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return int(default)
+
+
+# Status and support level given to new tickets that do not set their own
+DEFAULT_TICKET_STATUS = workflow.DECLARED
+DEFAULT_TICKET_ROLE = 'N1'
+
+def resolution_scope(role_id, role_name):
+    """PostgREST logic-tree clause selecting the resolution queue of a support level"""
+    if role_name == DEFAULT_TICKET_ROLE:
+        # N1 handles tickets assigned to N1 or unassigned
+        return f"or(assigned_role_id.eq.{role_id},assigned_role_id.is.null)"
+    # Others only handle tickets assigned to their role
+    return f"assigned_role_id.eq.{role_id}"
+
+
+def in_resolution_scope(ticket, role_id, role_name):
+    """Whether a ticket read from the database is in the queue resolution_scope selects"""
+    assigned_role_id = ticket.get('assigned_role_id')
+    if role_name == DEFAULT_TICKET_ROLE and assigned_role_id is None:
+        return True
+    return assigned_role_id is not None and assigned_role_id == role_id
+
+
+# Ticket list filters that map directly to an equality on a ticket column
+TICKET_FILTER_COLUMNS = {
+    'status': 'statut_id',
+    'category': 'categorie_id',
+    'role': 'assigned_role_id',
+}
+
+
+# Named column projections for ticket reads. List profiles only select what
+# their view renders and alias the description_excerpt computed column (see
+# sql/ticket_description_excerpt.sql) to description. The detail profile
+# embeds the ticket's files through the fichier foreign key
+# (sql/fichier_ticket_fk.sql), dropped when the key is missing.
+FICHIER_EMBED = ",fichier(id,nom,size_bytes)"
+TICKET_PROJECTIONS = {
+    # Requester dashboards: title, excerpt, date and status cards
+    'list': "id,titre,description:description_excerpt,date_creation,statut(nom)",
+    # Admin ticket table
+    'admin': "id,titre,description:description_excerpt,date_creation,statut(nom),utilisateur(nom_utilisateur,prenom,nom),required_habilitation_id,assigned_role_id",
+    # Resolution queue
+    'resolution': "id,titre,description:description_excerpt,date_creation,statut(nom),utilisateur(nom_utilisateur),required_habilitation_id,assigned_role_id",
+    # Single ticket with every field
+    'detail': "id,titre,description,date_creation,date_mise_a_jour,date_cloture,statut_id,statut(nom),priorite_id,priorite(nom),categorie_id,categorie(nom),type_id,type(nom),idutilisateur,utilisateur(nom_utilisateur,prenom,nom),assigned_role_id,required_habilitation_id,resolution_due_at,resolution_attempts" + FICHIER_EMBED,
+}
+
+
+# Prefer: count= methods accepted by PostgREST
+COUNT_METHODS = ('exact', 'planned', 'estimated')
+
+# User columns listed by the user management views
+USER_COLUMNS = "id,nom_utilisateur,email,prenom,nom,role_id,role(nom)"
+
+# Layout version of the reference-data snapshot file; files of another version are ignored
+SNAPSHOT_FORMAT = 2
+
+
+def private_tempdir():
+    """Directory for the runtime files of this user's processes, created with mode 0700.
+    
+    Raises OSError when the path exists but is not a private directory of
+    this user, e.g. created beforehand by another local user.
+    """
+    uid = os.getuid() if hasattr(os, "getuid") else None  # Windows temp dirs are already per user
+    path = os.path.join(tempfile.gettempdir(), "digitickets" if uid is None else f"digitickets-{uid}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if uid is not None:
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != uid or st.st_mode & 0o077:
+            raise OSError(f"{path} is not a private directory of uid {uid}")
+    return path
+
+
+def parse_content_range_total(content_range):
+    """Total from a PostgREST Content-Range header ("0-24/3573", "*/0"); None if not counted"""
+    if not content_range or '/' not in content_range:
+        return None
+    total = content_range.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
+
+
+def encode_ticket_cursor(ticket):
+    """Opaque keyset cursor for a ticket row: (date_creation, id)"""
+    raw = f"{ticket['date_creation']}|{ticket['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_ticket_cursor(cursor):
+    """Decode a cursor produced by encode_ticket_cursor, or None if invalid"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_creation, ticket_id = raw.rsplit('|', 1)
+        datetime.fromisoformat(date_creation)
+        return date_creation, int(ticket_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _parse_date(value):
+    """Parse a YYYY-MM-DD (or ISO datetime) filter value, or None if invalid"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+# Reference tables loaded together by the ReferenceData registry: name -> query
+REFERENCE_TABLES = {
+    'roles': "role?select=id,nom,description",
+    'statuses': "statut?select=id,nom",
+    'categories': "categorie?select=id,nom",
+    'types': "type?select=id,nom",
+    'priorities': "priorite?select=id,nom",
+    'habilitations': "habilitation?select=id,nom,categorie&order=categorie,nom",
+}
+
+
+class ReferenceData:
+    """Immutable snapshot of the reference tables with O(1) lookups.
+    
+    A snapshot is never modified after construction; SupabaseDB swaps in a
+    new one when the data changes, so threads read it without locks.
+    """
+    
+    __slots__ = ('version', 'source', '_rows', '_by_id', '_by_name')
+    
+    def __init__(self, tables, version=0):
+        rows = {}
+        by_id = {}
+        by_name = {}
+        for table in REFERENCE_TABLES:
+            frozen = tuple(MappingProxyType(dict(row)) for row in tables.get(table) or [])
+            rows[table] = frozen
+            by_id[table] = MappingProxyType({row['id']: row for row in frozen})
+            by_name[table] = MappingProxyType({row['nom']: row for row in frozen})
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'source', tables)
+        object.__setattr__(self, '_rows', MappingProxyType(rows))
+        object.__setattr__(self, '_by_id', MappingProxyType(by_id))
+        object.__setattr__(self, '_by_name', MappingProxyType(by_name))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("ReferenceData is immutable")
+    
+    def all(self, table):
+        """All rows of a table, in load order"""
+        return self._rows[table]
+    
+    def get(self, table, row_id):
+        """Row by id, or None"""
+        return self._by_id[table].get(row_id)
+    
+    def get_by_name(self, table, name):
+        """Row by nom, or None"""
+        return self._by_name[table].get(name)
+    
+    def id_of(self, table, name):
+        """Id of the row named name, or None"""
+        row = self._by_name[table].get(name)
+        return row['id'] if row else None
+
+
+class PermissionMatrix:
+    """Immutable role -> habilitation permission matrix.
+    
+    Each role's habilitations are a bitset held in a Python int, where bit n
+    is set when the role has habilitation id n. A changed table gives a new
+    matrix, so readers never take a lock.
+    """
+    
+    __slots__ = ('source', '_bits')
+    
+    def __init__(self, rows):
+        bits = {}
+        for row in rows:
+            bits[row['role_id']] = bits.get(row['role_id'], 0) | (1 << row['habilitation_id'])
+        object.__setattr__(self, 'source', rows)
+        object.__setattr__(self, '_bits', MappingProxyType(bits))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("PermissionMatrix is immutable")
+    
+    def has(self, role_id, habilitation_id):
+        """Whether the role has the habilitation"""
+        return bool((self._bits.get(role_id, 0) >> habilitation_id) & 1)
+    
+    def habilitation_ids(self, role_id):
+        """Habilitation ids of a role"""
+        return frozenset(self._ids_of(self._bits.get(role_id, 0)))
+    
+    @staticmethod
+    def _ids_of(bits):
+        """Set bit positions of bits, lowest first"""
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+
+class TicketPageStream:
+    """One keyset page of tickets, fetched when first iterated.
+    
+    A streamed template can send its head and filters before the ticket
+    query runs; next_cursor and prev_cursor are known once the rows are.
+    """
+    
+    def __init__(self, load):
+        self._load = load
+        self._page = None
+    
+    def _get(self):
+        if self._page is None:
+            try:
+                self._page = self._load()
+            except Exception as e:
+                print(f"Error loading ticket page: {e}")
+                self._page = {'tickets': [], 'next_cursor': None, 'prev_cursor': None}
+        return self._page
+    
+    def __iter__(self):
+        # A generator, so iter(page) (e.g. in a generator expression) does not run the query yet
+        yield from self._get()['tickets']
+    
+    @property
+    def next_cursor(self):
+        return self._get()['next_cursor']
+    
+    @property
+    def prev_cursor(self):
+        return self._get()['prev_cursor']
+
+
+class SupabaseTransport:
+    """Pooled keep-alive HTTP transport for the Supabase REST API.
+
+    A single requests.Session is shared by every thread; its urllib3 pool is
+    thread-safe and keeps TCP/TLS connections alive between calls. Only
+    idempotent methods are retried, with jittered exponential backoff.
+    """
+
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "DELETE"})
+    RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+    def __init__(self, base_url, api_key, pool_size=10, connect_timeout=5.0,
+                 read_timeout=20.0, max_retries=2, backoff_base=0.2, backoff_max=2.0):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # Auth headers are built once; per-call extras are merged on top
+        self.headers = {
+            "apikey": api_key,
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Prefer": "return=representation"
+        }
+
+        # Retries are handled in request() so that only idempotent calls are replayed
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._retries = 0
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff delay for the given attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, path, json=None, params=None, headers=None):
+        """Send a request through the pool, retrying idempotent methods"""
+        if not tracing.is_active():
+            return self._request(method, path, json, params, headers)
+        
+        method = method.upper()
+        endpoint = path.split("?", 1)[0]
+        query = [path.split("?", 1)[1]] if "?" in path else []
+        query += [f"{key}={value}" for key, value in sorted(params or [])]
+        signature = f"{method} {endpoint}?{'&'.join(query)}"
+        with tracing.span(f"{method} {endpoint}", 'http', method=method, endpoint=endpoint,
+                          signature=signature) as span:
+            response = self._request(method, path, json, params, headers)
+            span.attrs['status'] = response.status_code
+            return response
+
+    def _request(self, method, path, json, params, headers):
+        method = method.upper()
+        url = f"{self.base_url}/{path}"
+        if headers:
+            headers = {**self.headers, **headers}
+        else:
+            headers = self.headers
+        retries = self.max_retries if method in self.IDEMPOTENT_METHODS else 0
+
+        endpoint = path.split("?", 1)[0]
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=headers, json=json,
+                                                params=params, timeout=self.timeout)
+                metrics.record_backend_call(endpoint, method, response.status_code, len(response.content),
+                                            time.perf_counter() - started)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= retries:
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                metrics.record_backend_call(endpoint, method, "error", 0, time.perf_counter() - started)
+                if attempt >= retries:
+                    raise
+            with self._lock:
+                self._retries += 1
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def get_stats(self):
+        """Pool statistics: connections opened (misses) vs reused (hits)"""
+        pool = self._adapter.poolmanager.connection_from_url(self.base_url)
+        misses = pool.num_connections
+        requests_sent = pool.num_requests
+        return {
+            "requests": requests_sent,
+            "pool_hits": max(requests_sent - misses, 0),
+            "pool_misses": misses,
+            "retries": self._retries,
+        }
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+
+@tracing.traced_methods
 class SupabaseDB:
     def __init__(self):
         self.supabase_url = os.environ.get("SUPABASE_URL")
@@ -23,11 +393,9 @@ class SupabaseDB:
             or os.environ.get("SUPABASE_KEY")
             or os.environ.get("SUPABASE_ANON_KEY")
         )
-        # Request timeout (seconds)
-        try:
-            self.request_timeout = float(os.environ.get("SUPABASE_REQUEST_TIMEOUT", "20"))
-        except ValueError:
-            self.request_timeout = 20.0
+        # Read timeout (seconds) and connect timeout, kept separate so a dead host fails fast
+        self.request_timeout = _env_float("SUPABASE_REQUEST_TIMEOUT", "20")
+        self.connect_timeout = _env_float("SUPABASE_CONNECT_TIMEOUT", "5")
         
         if not self.supabase_url or not self.supabase_key:
             raise ValueError("SUPABASE_URL and a Supabase key must be set (SERVICE_ROLE/KEY/ANON)")
@@ -35,59 +403,118 @@ class SupabaseDB:
         # Remove trailing slash from URL
         self.supabase_url = self.supabase_url.rstrip('/')
         
+        # Shared keep-alive connection pool for every REST call
+        self.transport = SupabaseTransport(
+            f"{self.supabase_url}/rest/v1",
+            self.supabase_key,
+            pool_size=_env_int("SUPABASE_POOL_SIZE", "10"),
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.request_timeout,
+            max_retries=_env_int("SUPABASE_MAX_RETRIES", "2"),
+            backoff_base=_env_float("SUPABASE_RETRY_BACKOFF", "0.2"),
+        )
+        
+        # Bounded worker pool for independent sub-queries of a page bundle
+        self._executor = ThreadPoolExecutor(
+            max_workers=_env_int("SUPABASE_FANOUT_WORKERS", "8"),
+            thread_name_prefix="supabase-fanout",
+        )
+        self.bundle_timeout = _env_float("SUPABASE_BUNDLE_TIMEOUT", "10")
+        # Separate pool for the reference tables, which bundle sub-queries may wait on
+        self._reference_executor = ThreadPoolExecutor(
+            max_workers=len(REFERENCE_TABLES),
+            thread_name_prefix="supabase-reference",
+        )
+        
+        # Ids per PATCH in bulk updates, keeping the id=in.(...) URL short
+        self.bulk_chunk_size = _env_int("SUPABASE_BULK_CHUNK_SIZE", "200")
+        
+        # Default number of tickets per page for the paginated list views
+        self.page_size = _env_int("TICKET_PAGE_SIZE", "50")
+        # Rows per request when a whole table is streamed (see iter_users)
+        self.stream_chunk_size = _env_int("SUPABASE_STREAM_CHUNK_SIZE", "500")
+        
+        # List projections read the server-truncated description; switched off
+        # automatically if the computed column is not installed
+        self.use_description_excerpt = os.environ.get("SUPABASE_DESCRIPTION_EXCERPT", "1") != "0"
+        # Tickets are created through the create_ticket RPC; switched off
+        # automatically if the function is not installed
+        self.use_create_ticket_rpc = os.environ.get("SUPABASE_CREATE_TICKET_RPC", "1") != "0"
+        # Tickets and their files are read in one request through the fichier
+        # foreign key; switched off automatically if it is not installed
+        self.use_fichier_embed = os.environ.get("SUPABASE_FICHIER_EMBED", "1") != "0"
+        # Workflow functions found missing (see _workflow_rpc)
+        self._missing_rpcs = set()
+        
+        # Current reference-data snapshot (see get_reference_data)
+        self._reference = ReferenceData({})
+        # Current role/habilitation matrix (see get_permission_matrix)
+        self._permissions = PermissionMatrix([])
+        # Serializes role_habilitation writes and the reload that follows each one
+        self._permissions_write_lock = threading.Lock()
+        
+        # Reference data persisted across restarts (see load_snapshot); an
+        # empty SUPABASE_SNAPSHOT_PATH disables the file
+        self.snapshot_path = os.environ.get("SUPABASE_SNAPSHOT_PATH")
+        if self.snapshot_path is None:
+            try:
+                self.snapshot_path = os.path.join(private_tempdir(), "reference.json")
+            except OSError as e:
+                print(f"Reference snapshot disabled: {e}")
+                self.snapshot_path = ""
+        self._persisted = None  # Reference tables last read from or written to the file
+        # Set once the background warm-up has revalidated the data loaded from the snapshot
+        self._warmed_up = threading.Event()
+        
         # Cache for frequently accessed data
-        self._cache = {}
-        self._cache_ttl = {}
-        self._cache_duration = 300  # 5 minutes cache
+        self._cache_duration = _env_float("SUPABASE_CACHE_TTL", "300")  # 5 minutes cache
+        self._ticket_cache_duration = _env_float("SUPABASE_TICKET_CACHE_TTL", "30")
+        self._cache = create_cache(
+            max_entries=_env_int("SUPABASE_CACHE_MAX_ENTRIES", "1024"),
+            default_ttl=self._cache_duration,
+            stale_ttl=_env_float("SUPABASE_CACHE_STALE_TTL", "60"),
+        )
     
     def _get_cached(self, key):
         """Get data from cache if not expired"""
-        if key in self._cache and key in self._cache_ttl:
-            if time.time() < self._cache_ttl[key]:
-                return self._cache[key]
-            else:
-                # Remove expired cache
-                del self._cache[key]
-                del self._cache_ttl[key]
-        return None
+        data = self._cache.get(key)
+        metrics.record_cache_lookup(data is not None)
+        return data
+    
+    def _set_cache(self, key, data, ttl=None, tags=None):
+        """Set data in cache with TTL and dependency tags"""
+        self._cache.set(key, data, ttl, tags)
+    
+    def _cached(self, key, loader, ttl=None, tags=None):
+        """Get data from cache, loading it once on a miss (concurrent misses share the load)"""
+        loaded = []
+        
+        def load():
+            loaded.append(True)
+            return loader()
+        
+        try:
+            return self._cache.get_or_load(key, load, ttl, tags)
+        finally:
+            metrics.record_cache_lookup(not loaded)
     
-    def _set_cache(self, key, data):
-        """Set data in cache with TTL"""
-        self._cache[key] = data
-        self._cache_ttl[key] = time.time() + self._cache_duration
-    
-    def _clear_cache(self, pattern=None):
-        """Clear cache, optionally by pattern"""
-        if pattern:
-            keys_to_remove = [k for k in self._cache.keys() if pattern in k]
-            for key in keys_to_remove:
-                self._cache.pop(key, None)
-                self._cache_ttl.pop(key, None)
+    def _clear_cache(self, *tags):
+        """Clear cache entries depending on tags, or everything"""
+        if tags:
+            self._cache.invalidate_tags(*tags)
         else:
             self._cache.clear()
-            self._cache_ttl.clear()
         
     def _make_request(self, method, endpoint, data=None, params=None):
         """Make a request to Supabase REST API"""
-        url = f"{self.supabase_url}/rest/v1/{endpoint}"
-        headers = {
-            "apikey": self.supabase_key,
-            "Authorization": f"Bearer {self.supabase_key}",
-            "Content-Type": "application/json",
-            "Prefer": "return=representation"
-        }
+        if method.upper() not in ("GET", "POST", "PATCH", "DELETE"):
+            raise ValueError(f"Unsupported HTTP method: {method}")
         
         try:
             if method.upper() == "GET":
-                response = requests.get(url, headers=headers, params=params, timeout=self.request_timeout)
-            elif method.upper() == "POST":
-                response = requests.post(url, headers=headers, json=data, timeout=self.request_timeout)
-            elif method.upper() == "PATCH":
-                response = requests.patch(url, headers=headers, json=data, timeout=self.request_timeout)
-            elif method.upper() == "DELETE":
-                response = requests.delete(url, headers=headers, timeout=self.request_timeout)
+                response = self.transport.request("GET", endpoint, params=params)
             else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
+                response = self.transport.request(method, endpoint, json=data, params=params)
             
             response.raise_for_status()
             return response.json() if response.content else []
@@ -102,6 +529,69 @@ class SupabaseDB:
                     pass
             raise
     
+    def _fetch_bundle(self, tasks, defaults, label="bundle"):
+        """Run independent sub-queries concurrently under one deadline.
+        
+        tasks maps a result key to a zero-argument callable. Sub-queries that
+        fail or miss the deadline fall back to their entry in defaults, so the
+        caller still gets every other result.
+        """
+        # Sub-queries run in the caller's context, so they count towards its request metrics
+        futures = {self._executor.submit(contextvars.copy_context().run, fn): key for key, fn in tasks.items()}
+        done, not_done = wait(futures, timeout=self.bundle_timeout)
+        
+        results = {}
+        for future, key in futures.items():
+            if future in done:
+                try:
+                    results[key] = future.result()
+                    continue
+                except Exception as e:
+                    print(f"Error loading {label} '{key}': {e}")
+            else:
+                future.cancel()
+                print(f"Timed out loading {label} '{key}' after {self.bundle_timeout}s")
+            results[key] = defaults[key]
+        return results
+    
+    def _projection(self, profile):
+        """Select list for a named ticket projection profile"""
+        select = TICKET_PROJECTIONS[profile]
+        if not self.use_description_excerpt:
+            select = select.replace("description:description_excerpt", "description")
+        if not self.use_fichier_embed:
+            select = select.replace(FICHIER_EMBED, "")
+        return select
+    
+    def _get_tickets(self, profile, query="", params=None):
+        """GET tickets using a named projection profile.
+        
+        A projection part whose migration is missing is switched off on the
+        first error naming it, and the request retried without it.
+        """
+        endpoint = f"ticket?{query}" if query else "ticket"
+        params = list(params or [])
+        while True:
+            try:
+                return self._make_request("GET", endpoint, params=[("select", self._projection(profile))] + params)
+            except requests.exceptions.HTTPError as e:
+                response = e.response
+                if (self.use_description_excerpt and response is not None and response.status_code == 400
+                        and 'description_excerpt' in response.text):
+                    print("description_excerpt column not found; list views fall back to full descriptions")
+                    self.use_description_excerpt = False
+                elif not self._fichier_fk_missing(response):
+                    raise
+    
+    def _fichier_fk_missing(self, response):
+        """Whether response reports the missing fichier/ticket foreign key, switching the file embeds off"""
+        if not (self.use_fichier_embed and response is not None and response.status_code == 400
+                and 'relationship' in response.text and 'fichier' in response.text):
+            return False
+        print("fichier foreign key not found; ticket files are read with separate requests")
+        self.use_fichier_embed = False
+        return True
+    
     # User operations
     def get_user_by_credentials(self, username, password):
         """Get user by username and password"""
@@ -142,23 +632,45 @@ class SupabaseDB:
     
     def get_all_users(self):
         """Get all users with role information and caching"""
-        cache_key = "all_users"
-        cached = self._get_cached(cache_key)
-        if cached is not None:
-            return cached
-            
         try:
-            result = self._make_request("GET", "utilisateur?select=id,nom_utilisateur,email,prenom,nom,role_id,role(nom)")
-            self._set_cache(cache_key, result)
-            return result
+            return self._cached("all_users", lambda: self._make_request("GET", f"utilisateur?select={USER_COLUMNS}"), tags=["users"])
         except Exception as e:
             print(f"Error getting all users: {e}")
             return []
     
+    def iter_users(self, chunk_size=None):
+        """Yield every user with role information.
+        
+        Served from the cached user list when it is loaded; otherwise the
+        table is read chunk_size rows per request in id order, so the whole
+        list is never held in memory. Stops early if a request fails.
+        """
+        users = self._get_cached("all_users")
+        if users is not None:
+            yield from users
+            return
+        
+        chunk_size = chunk_size or self.stream_chunk_size
+        last_id = None
+        while True:
+            params = [("select", USER_COLUMNS), ("order", "id"), ("limit", str(chunk_size))]
+            if last_id is not None:
+                params.append(("id", f"gt.{last_id}"))
+            try:
+                rows = self._make_request("GET", "utilisateur", params=params)
+            except Exception as e:
+                print(f"Error streaming users after id {last_id}: {e}")
+                return
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1]['id']
+    
     def create_user(self, user_data):
         """Create a new user"""
         try:
             result = self._make_request("POST", "utilisateur", data=user_data)
+            self._clear_cache("users")
             return result[0] if result else None
         except Exception as e:
             print(f"Error creating user: {e}")
@@ -168,6 +680,7 @@ class SupabaseDB:
         """Update a user"""
         try:
             result = self._make_request("PATCH", f"utilisateur?id=eq.{user_id}", data=user_data)
+            self._clear_cache("users")
             return result[0] if result else None
         except Exception as e:
             print(f"Error updating user: {e}")
@@ -177,6 +690,7 @@ class SupabaseDB:
         """Delete a user"""
         try:
             self._make_request("DELETE", f"utilisateur?id=eq.{user_id}")
+            self._clear_cache("users")
             return True
         except Exception as e:
             print(f"Error deleting user: {e}")
@@ -184,61 +698,40 @@ class SupabaseDB:
     
     # Role operations
     def get_role_by_name(self, role_name):
-        """Get role by name"""
-        try:
-            result = self._make_request("GET", f"role?nom=eq.{role_name}&select=id")
-            return result[0]['id'] if result else None
-        except Exception as e:
-            print(f"Error getting role by name: {e}")
-            return None
+        """Get role id by name"""
+        return self.get_reference_data().id_of('roles', role_name)
     
     def get_all_roles(self):
         """Get all roles with caching"""
-        cache_key = "all_roles"
-        cached = self._get_cached(cache_key)
-        if cached is not None:
-            return cached
-            
-        try:
-            result = self._make_request("GET", "role?select=id,nom,description")
-            self._set_cache(cache_key, result)
-            return result
-        except Exception as e:
-            print(f"Error getting all roles: {e}")
-            return []
+        return list(self.get_reference_data().all('roles'))
     
     def get_role_by_id(self, role_id):
         """Get role by ID"""
-        try:
-            result = self._make_request("GET", f"role?id=eq.{role_id}&select=id,nom,description")
-            return result[0] if result else None
-        except Exception as e:
-            print(f"Error getting role by ID: {e}")
-            return None
+        return self.get_reference_data().get('roles', role_id)
     
     # Ticket operations
-    def get_user_tickets(self, user_id):
+    def get_user_tickets(self, user_id, profile='list'):
         """Get tickets for a specific user"""
         try:
-            result = self._make_request("GET", f"ticket?idutilisateur=eq.{user_id}&select=id,titre,description,date_creation,statut_id,statut(nom)&order=date_creation.desc")
+            result = self._get_tickets(profile, f"idutilisateur=eq.{user_id}&order=date_creation.desc")
             return result
         except Exception as e:
             print(f"Error getting user tickets: {e}")
             return []
     
-    def get_all_tickets(self):
+    def get_all_tickets(self, profile='admin'):
         """Get all tickets with user and status information"""
         try:
-            result = self._make_request("GET", "ticket?select=id,titre,description,date_creation,statut_id,statut(nom),idutilisateur,utilisateur(nom_utilisateur,prenom,nom)&order=date_creation.desc")
+            result = self._get_tickets(profile, "order=date_creation.desc")
             return result
         except Exception as e:
             print(f"Error getting all tickets: {e}")
             return []
     
-    def get_tickets_by_role(self, role_id):
+    def get_tickets_by_role(self, role_id, profile='resolution'):
         """Get tickets assigned to a specific role"""
         try:
-            result = self._make_request("GET", f"ticket?assigned_role_id=eq.{role_id}&select=id,titre,description,date_creation,statut_id,statut(nom),idutilisateur,utilisateur(nom_utilisateur),required_habilitation_id,assigned_role_id&order=date_creation.desc")
+            result = self._get_tickets(profile, f"assigned_role_id=eq.{role_id}&order=date_creation.desc")
             return result
         except Exception as e:
             print(f"Error getting tickets by role: {e}")
@@ -248,34 +741,108 @@ class SupabaseDB:
         """Create a new ticket"""
         try:
             result = self._make_request("POST", "ticket", data=ticket_data)
+            self._clear_cache(f"tickets:user:{ticket_data.get('idutilisateur')}")
             return result[0] if result else None
         except Exception as e:
             print(f"Error creating ticket: {e}")
             return None
     
+    def open_ticket(self, ticket_data, attachment=None, idempotency_key=None):
+        """Create a complete ticket in one request.
+        
+        The default status and N1 assignment come from cached reference data
+        unless ticket_data sets them. attachment is an optional fichier
+        metadata dict, inserted with the ticket in the same transaction by
+        the create_ticket function (sql/create_ticket_rpc.sql). Calling again
+        with the same idempotency_key returns the ticket created the first
+        time instead of a duplicate.
+        """
+        reference = self.get_reference_data()
+        row = dict(ticket_data)
+        row.setdefault('date_creation', datetime.now().isoformat())
+        if not row.get('statut_id'):
+            row['statut_id'] = reference.id_of('statuses', DEFAULT_TICKET_STATUS)
+            if not row['statut_id']:
+                print(f"Error creating ticket: status '{DEFAULT_TICKET_STATUS}' not found")
+                return None
+        if not row.get('assigned_role_id'):
+            row['assigned_role_id'] = reference.id_of('roles', DEFAULT_TICKET_ROLE)
+        
+        try:
+            ticket = self._create_ticket_rpc(row, attachment, idempotency_key)
+        except Exception as e:
+            print(f"Error creating ticket: {e}")
+            return None
+        if ticket:
+            self._clear_cache(f"tickets:user:{ticket.get('idutilisateur')}")
+        return ticket
+    
+    def _create_ticket_rpc(self, row, attachment, idempotency_key):
+        if self.use_create_ticket_rpc:
+            try:
+                result = self._make_request("POST", "rpc/create_ticket", data={
+                    'new_ticket': dict(row, idempotency_key=idempotency_key),
+                    'attachment': attachment,
+                })
+                return result[0] if result else None
+            except requests.exceptions.HTTPError as e:
+                response = e.response
+                if not (response is not None and response.status_code == 404):
+                    raise
+            print("create_ticket function not found; tickets are created without idempotency keys")
+            self.use_create_ticket_rpc = False
+        
+        # Without the function: ticket row, then attachment row
+        result = self._make_request("POST", "ticket", data=row)
+        ticket = result[0] if result else None
+        if ticket and attachment:
+            self._make_request("POST", "fichier", data=dict(attachment, ticket_id=ticket['id']))
+        return ticket
+    
     def update_ticket(self, ticket_id, ticket_data):
         """Update a ticket"""
         try:
             result = self._make_request("PATCH", f"ticket?id=eq.{ticket_id}", data=ticket_data)
+            self._invalidate_ticket_write(result, ticket_data)
             return result[0] if result else None
         except Exception as e:
             print(f"Error updating ticket: {e}")
             return None
     
     def delete_ticket(self, ticket_id):
-        """Delete a ticket"""
+        """Delete a ticket, then its fichier rows (already gone where the foreign key cascades)"""
         try:
-            self._make_request("DELETE", f"ticket?id=eq.{ticket_id}")
-            return True
+            result = self._make_request("DELETE", f"ticket?id=eq.{ticket_id}")
+            self._invalidate_ticket_write(result)
         except Exception as e:
             print(f"Error deleting ticket: {e}")
             return False
+        try:
+            self._make_request("DELETE", f"fichier?ticket_id=eq.{ticket_id}")
+        except Exception as e:
+            # Rows left behind only keep their content stored
+            print(f"Error deleting ticket files: {e}")
+        return True
+    
+    def _invalidate_ticket_write(self, rows, changes=None):
+        """Evict cached ticket lists affected by a write to rows.
+        
+        Only the owners' lists are evicted, unless the write moved a ticket to
+        another owner (whose previous owner is unknown here).
+        """
+        if (changes and 'idutilisateur' in changes) or not rows:
+            self._clear_cache("tickets")
+            return
+        self._clear_cache(*{f"tickets:user:{row.get('idutilisateur')}" for row in rows})
     
     def get_ticket_by_id(self, ticket_id):
         """Get ticket by ID with all related data"""
         try:
-            result = self._make_request("GET", f"ticket?id=eq.{ticket_id}&select=id,titre,description,date_creation,date_mise_a_jour,date_cloture,statut_id,statut(nom),priorite_id,priorite(nom),categorie_id,categorie(nom),type_id,type(nom),idutilisateur,utilisateur(nom_utilisateur,prenom,nom),assigned_role_id,required_habilitation_id,resolution_due_at,resolution_attempts")
-            return result[0] if result else None
+            result = self._get_tickets('detail', f"id=eq.{ticket_id}")
+            ticket = result[0] if result else None
+            if ticket and not self.use_fichier_embed:
+                ticket['fichier'] = self._make_request("GET", f"fichier?ticket_id=eq.{ticket_id}&select=id,nom,size_bytes")
+            return ticket
         except Exception as e:
             print(f"Error getting ticket by ID: {e}")
             return None
@@ -283,104 +850,144 @@ class SupabaseDB:
     # Status operations
     def get_all_statuses(self):
         """Get all statuses with caching"""
-        cache_key = "all_statuses"
-        cached = self._get_cached(cache_key)
-        if cached is not None:
-            return cached
-            
-        try:
-            result = self._make_request("GET", "statut?select=id,nom")
-            self._set_cache(cache_key, result)
-            return result
-        except Exception as e:
-            print(f"Error getting all statuses: {e}")
-            return []
+        return list(self.get_reference_data().all('statuses'))
     
     def get_status_by_name(self, status_name):
-        """Get status by name with caching"""
-        cache_key = f"status_by_name_{status_name}"
-        cached = self._get_cached(cache_key)
-        if cached is not None:
-            return cached
-            
-        try:
-            result = self._make_request("GET", f"statut?nom=eq.{status_name}&select=id")
-            status_id = result[0]['id'] if result else None
-            self._set_cache(cache_key, status_id)
-            return status_id
-        except Exception as e:
-            print(f"Error getting status by name: {e}")
-            return None
+        """Get status id by name with caching"""
+        return self.get_reference_data().id_of('statuses', status_name)
     
     # Category operations
     def get_all_categories(self):
         """Get all categories with caching"""
-        cache_key = "all_categories"
-        cached = self._get_cached(cache_key)
-        if cached is not None:
-            return cached
-            
-        try:
-            result = self._make_request("GET", "categorie?select=id,nom")
-            self._set_cache(cache_key, result)
-            return result
-        except Exception as e:
-            print(f"Error getting all categories: {e}")
-            return []
+        return list(self.get_reference_data().all('categories'))
     
     # Type operations
     def get_all_types(self):
         """Get all types with caching"""
-        cache_key = "all_types"
-        cached = self._get_cached(cache_key)
-        if cached is not None:
-            return cached
-            
-        try:
-            result = self._make_request("GET", "type?select=id,nom")
-            self._set_cache(cache_key, result)
-            return result
-        except Exception as e:
-            print(f"Error getting all types: {e}")
-            return []
+        return list(self.get_reference_data().all('types'))
+    
+    # Priority operations
+    def get_all_priorities(self):
+        """Get all priorities with caching"""
+        return list(self.get_reference_data().all('priorities'))
     
     # Habilitation operations
     def get_all_habilitations(self):
         """Get all habilitations with caching"""
-        cache_key = "all_habilitations"
-        cached = self._get_cached(cache_key)
-        if cached is not None:
-            return cached
-            
+        return list(self.get_reference_data().all('habilitations'))
+    
+    # Reference data
+    def _load_reference_tables(self):
+        """Fetch every reference table concurrently; any failure fails the load"""
+        futures = {
+            table: self._reference_executor.submit(contextvars.copy_context().run, self._make_request, "GET", query)
+            for table, query in REFERENCE_TABLES.items()
+        }
+        return {table: future.result(timeout=self.bundle_timeout) for table, future in futures.items()}
+    
+    def get_reference_data(self):
+        """Get the current ReferenceData snapshot, loading it on first use.
+        
+        The raw tables live in the cache under the reference tags, so the TTL
+        and any invalidation (also broadcast from other workers) trigger a
+        reload; a new snapshot is built only when the cached tables change.
+        If loading fails the previous snapshot is kept. Until the warm-up has
+        revalidated it, data restored from the snapshot file is served as is.
+        """
+        if not self._warmed_up.is_set() and self._reference.source:
+            return self._reference
+        return self._load_reference_data()
+    
+    def _load_reference_data(self):
         try:
-            result = self._make_request("GET", "habilitation?select=id,nom,categorie&order=categorie,nom")
-            self._set_cache(cache_key, result)
-            return result
+            tables = self._cached("reference_data", self._load_reference_tables, tags=list(REFERENCE_TABLES))
         except Exception as e:
-            print(f"Error getting all habilitations: {e}")
-            return []
+            print(f"Error loading reference data: {e}")
+            return self._reference
+        
+        reference = self._reference
+        if reference.source is not tables:
+            # A shared cache backend decodes a new copy on every refresh:
+            # only tables that differ in value make a new version
+            changed = tables != reference.source
+            reference = ReferenceData(tables, version=reference.version + 1 if changed else reference.version)
+            self._reference = reference
+            if changed:
+                self.save_snapshot()
+        return reference
     
-    def get_role_habilitations(self, role_id):
-        """Get habilitations for a specific role"""
+    def get_permission_matrix(self):
+        """Get the current PermissionMatrix, loading the whole role_habilitation table on first use.
+        
+        Like the reference data, the raw rows are cached under the
+        role_habilitations tag and the matrix is rebuilt only when they change.
+        The matrix drives access checks, so it is never restored from the
+        snapshot file.
+        """
+        return self._load_permission_matrix()
+    
+    def _load_permission_matrix(self):
         try:
-            result = self._make_request("GET", f"role_habilitation?role_id=eq.{role_id}&select=habilitation_id,habilitation(id,nom,categorie)")
-            return [item['habilitation'] for item in result]
+            rows = self._cached("role_habilitation_matrix",
+                                lambda: self._make_request("GET", "role_habilitation?select=role_id,habilitation_id"),
+                                tags=["role_habilitations"])
         except Exception as e:
-            print(f"Error getting role habilitations: {e}")
-            return []
+            print(f"Error loading role habilitations: {e}")
+            return self._permissions
+        
+        matrix = self._permissions
+        if matrix.source is not rows:
+            matrix = self._permissions = PermissionMatrix(rows)
+        return matrix
+    
+    def _write_permissions(self, method, endpoint, data=None):
+        """Write to role_habilitation, then reload the matrix from the table.
+        
+        The matrix is never derived from a copy read before the write, so
+        concurrent grants and revocations, here or in another worker, cannot
+        drop each other's change.
+        """
+        with self._permissions_write_lock:
+            self._make_request(method, endpoint, data=data)
+            # Every worker drops its copy, this one included
+            self._clear_cache("role_habilitations")
+            self._load_permission_matrix()
+    
+    def get_role_habilitations(self, role_id):
+        """Get habilitations for a specific role"""
+        hab_ids = self.get_permission_matrix().habilitation_ids(role_id)
+        return [h for h in self.get_all_habilitations() if h['id'] in hab_ids]
     
     def check_role_has_habilitation(self, role_id, habilitation_id):
         """Check if a role has a specific habilitation"""
+        return self.get_permission_matrix().has(role_id, habilitation_id)
+    
+    def add_role_habilitation(self, role_id, habilitation_id):
+        """Grant a habilitation to a role"""
         try:
-            result = self._make_request("GET", f"role_habilitation?role_id=eq.{role_id}&habilitation_id=eq.{habilitation_id}")
-            return len(result) > 0
+            self._write_permissions("POST", "role_habilitation", data={
+                'role_id': role_id,
+                'habilitation_id': habilitation_id
+            })
+            return True
         except Exception as e:
-            print(f"Error checking role habilitation: {e}")
+            print(f"Error adding role habilitation: {e}")
+            return False
+    
+    def remove_role_habilitation(self, role_id, habilitation_id):
+        """Revoke a habilitation from a role"""
+        try:
+            self._write_permissions(
+                "DELETE", f"role_habilitation?role_id=eq.{role_id}&habilitation_id=eq.{habilitation_id}"
+            )
+            return True
+        except Exception as e:
+            print(f"Error removing role habilitation: {e}")
             return False
     
     # File operations
     def create_file(self, file_data):
-        """Create a file record"""
+        """Create a file metadata record (the content lives in the attachment store)"""
         try:
             result = self._make_request("POST", "fichier", data=file_data)
             return result[0] if result else None
@@ -388,30 +995,124 @@ class SupabaseDB:
             print(f"Error creating file: {e}")
             return None
     
+    def get_ticket_storage_keys(self, ticket_id):
+        """Storage keys of the files of a ticket"""
+        try:
+            rows = self._make_request("GET", f"fichier?ticket_id=eq.{ticket_id}&select=storage_key")
+            return [row['storage_key'] for row in rows if row.get('storage_key')]
+        except Exception as e:
+            print(f"Error getting ticket files: {e}")
+            return []
+    
+    def unused_storage_keys(self, storage_keys):
+        """The storage keys no fichier row uses any more (content is shared between identical uploads).
+        
+        Returns [] on error, so content is only removed when it is known to be unused.
+        """
+        storage_keys = sorted(set(storage_keys))
+        if not storage_keys:
+            return []
+        try:
+            rows = self._make_request(
+                "GET", f"fichier?storage_key=in.({','.join(storage_keys)})&select=storage_key"
+            )
+        except Exception as e:
+            print(f"Error checking storage keys: {e}")
+            return []
+        used = {row['storage_key'] for row in rows}
+        return [key for key in storage_keys if key not in used]
+    
     def get_file_by_id(self, file_id):
-        """Get file by ID"""
+        """Get file metadata by ID, with the owner and assigned role of its ticket for access checks"""
+        columns = "id,ticket_id,nom,storage_key,sha256,size_bytes,content_type"
         try:
-            result = self._make_request("GET", f"fichier?id=eq.{file_id}&select=id,fichier,ticket_id")
-            return result[0] if result else None
+            if self.use_fichier_embed:
+                try:
+                    result = self._make_request(
+                        "GET", f"fichier?id=eq.{file_id}&select={columns},ticket(idutilisateur,assigned_role_id)"
+                    )
+                    return result[0] if result else None
+                except requests.exceptions.HTTPError as e:
+                    if not self._fichier_fk_missing(e.response):
+                        raise
+            
+            # Without the foreign key: file row, then its ticket
+            result = self._make_request("GET", f"fichier?id=eq.{file_id}&select={columns}")
+            fichier = result[0] if result else None
+            if fichier:
+                tickets = self._make_request(
+                    "GET", f"ticket?id=eq.{fichier['ticket_id']}&select=idutilisateur,assigned_role_id"
+                )
+                fichier['ticket'] = tickets[0] if tickets else None
+            return fichier
         except Exception as e:
             print(f"Error getting file by ID: {e}")
             return None
     
-    # Utility functions
-    def get_user_count(self, user_id):
-        """Get count of tickets for a user"""
+    # Counts
+    def count_rows(self, table, params=None, method="exact"):
+        """Number of rows of table matching params, without downloading them.
+        
+        Sends a HEAD request with Prefer: count=<method> and reads the total
+        from the Content-Range header, so the response size does not depend
+        on the number of rows. 'planned' uses the planner's estimate and
+        'estimated' only counts exactly below the server's max-rows; both are
+        cheaper on large tables. Raises on request errors.
+        """
+        if method not in COUNT_METHODS:
+            raise ValueError(f"Unsupported count method: {method}")
+        response = self.transport.request(
+            "HEAD", table, params=[("select", "id")] + list(params or []),
+            headers={"Prefer": f"count={method}"}
+        )
+        response.raise_for_status()
+        return parse_content_range_total(response.headers.get("Content-Range"))
+    
+    def count_tickets(self, filters=None, scope=None, method="exact"):
+        """Number of tickets matching the list filters and optional logic-tree scope; None on error"""
+        params = self._ticket_filter_params(filters or {})
+        if scope:
+            params.append(("and", f"({scope})"))
         try:
-            result = self._make_request("GET", f"ticket?idutilisateur=eq.{user_id}&select=id")
-            return len(result)
+            return self.count_rows("ticket", params, method)
         except Exception as e:
-            print(f"Error getting user ticket count: {e}")
-            return 0
+            print(f"Error counting tickets: {e}")
+            return None
+    
+    def count_tickets_by(self, group, filters=None, scope=None, method="exact"):
+        """Ticket counts per status ('status') or per assigned role ('role').
+        
+        One HEAD count per reference-data value, run concurrently; the
+        'role' grouping also counts unassigned tickets under None. Returns
+        {id: count}, leaving out the groups whose count failed.
+        """
+        column = TICKET_FILTER_COLUMNS[group]
+        table = {'status': 'statuses', 'role': 'roles'}[group]
+        filters = {k: v for k, v in (filters or {}).items() if k != group}
+        params = self._ticket_filter_params(filters)
+        if scope:
+            params.append(("and", f"({scope})"))
+        
+        values = [row['id'] for row in self.get_reference_data().all(table)]
+        if group == 'role':
+            values.append(None)
+        
+        def count(value):
+            condition = (column, "is.null" if value is None else f"eq.{value}")
+            return lambda: self.count_rows("ticket", params + [condition], method)
+        
+        counts = self._fetch_bundle({value: count(value) for value in values},
+                                    {value: None for value in values}, label=f"ticket counts by {group}")
+        return {value: n for value, n in counts.items() if n is not None}
+    
+    def get_user_count(self, user_id):
+        """Get count of tickets for a user; None on error"""
+        return self.count_tickets(scope=f"idutilisateur.eq.{int(user_id)}")
     
     def get_tickets_due_for_resolution(self):
         """Get tickets that are due for resolution"""
         try:
-            # Get the status ID for 'Incident en cours de résolution'
-            in_progress_id = self.get_status_by_name('Incident en cours de résolution')
+            in_progress_id = self.get_status_by_name(workflow.IN_RESOLUTION)
             if not in_progress_id:
                 return []
             
@@ -422,6 +1123,195 @@ class SupabaseDB:
             print(f"Error getting tickets due for resolution: {e}")
             return []
     
+    def get_resolution_deadlines(self):
+        """Get id and resolution_due_at of every ticket currently in resolution"""
+        try:
+            in_progress_id = self.get_status_by_name(workflow.IN_RESOLUTION)
+            if not in_progress_id:
+                return []
+            
+            return self._make_request("GET", f"ticket?statut_id=eq.{in_progress_id}&resolution_due_at=not.is.null&select=id,resolution_due_at")
+        except Exception as e:
+            print(f"Error getting resolution deadlines: {e}")
+            return []
+    
+    def resolve_due_tickets(self, ticket_ids):
+        """Mark tickets resolved if they are still in resolution and their deadline has passed.
+        
+        The conditions are part of the PATCH filter, so a ticket that was
+        refused or given a new deadline meanwhile is left untouched. Returns
+        the ids that were resolved.
+        """
+        source_ids, resolved_id = self._transition_status_ids(workflow.get_transition('resolve'))
+        if not source_ids or not resolved_id:
+            return []
+        
+        now = datetime.now().isoformat()
+        return self.bulk_update_tickets(
+            ticket_ids,
+            {"statut_id": resolved_id},
+            conditions=f"statut_id=in.({','.join(map(str, source_ids))})&resolution_due_at=lte.{now}"
+        )
+    
+    # Ticket workflow transitions (see workflow.py)
+    def _transition_status_ids(self, transition):
+        """(source status ids, target status id) of a transition, from reference data"""
+        reference = self.get_reference_data()
+        source_ids = [reference.id_of('statuses', name) for name in transition.sources]
+        return [i for i in source_ids if i], reference.id_of('statuses', transition.target)
+    
+    def transition_ticket(self, ticket_id, name, changes=None, conditions=None):
+        """Move a ticket through a workflow transition with one conditional PATCH.
+        
+        The PATCH only matches while the ticket is in one of the transition's
+        source statuses and matches conditions, a list of PostgREST
+        (column, filter) params such as the owner or assigned role. Of two
+        concurrent clicks only one can succeed. Returns the updated row
+        (id, idutilisateur), or None if the ticket could not take the
+        transition.
+        """
+        transition = workflow.get_transition(name)
+        source_ids, target_id = self._transition_status_ids(transition)
+        if not source_ids or not target_id:
+            print(f"Error in ticket transition {name}: status not found")
+            return None
+        
+        data = dict(changes or {}, statut_id=target_id)
+        params = [("id", f"eq.{ticket_id}"), ("statut_id", f"in.({','.join(map(str, source_ids))})"),
+                  ("select", "id,idutilisateur")] + list(conditions or [])
+        try:
+            result = self._make_request("PATCH", "ticket", data=data, params=params)
+        except Exception as e:
+            print(f"Error in ticket transition {name}: {e}")
+            return None
+        if result:
+            self._invalidate_ticket_write(result, data)
+        return result[0] if result else None
+    
+    def _workflow_rpc(self, function, args, fallback):
+        """Call a workflow function (sql/ticket_workflow.sql), or fallback() if it is not installed"""
+        if function not in self._missing_rpcs:
+            try:
+                return self._make_request("POST", f"rpc/{function}", data=args)
+            except requests.exceptions.HTTPError as e:
+                response = e.response
+                if not (response is not None and response.status_code == 404):
+                    raise
+            print(f"{function} function not found; using a read then a conditional PATCH")
+            self._missing_rpcs.add(function)
+        return fallback()
+    
+    def start_ticket_resolution(self, ticket_id, due_at, habilitation_ids=None):
+        """'start_resolution' transition, counting the attempt atomically.
+        
+        habilitation_ids are the acting role's habilitations: the ticket must
+        require one of them (None allows any qualified ticket). Returns the
+        updated row, or None.
+        """
+        if habilitation_ids is not None and not habilitation_ids:
+            return None
+        source_ids, target_id = self._transition_status_ids(workflow.get_transition('start_resolution'))
+        if not source_ids or not target_id:
+            print("Error starting ticket resolution: status not found")
+            return None
+        
+        conditions = [("required_habilitation_id", "not.is.null")]
+        if habilitation_ids is not None:
+            conditions = [("required_habilitation_id", f"in.({','.join(map(str, sorted(habilitation_ids)))})")]
+        
+        def read_then_patch():
+            # Optimistic: the PATCH only applies if nobody counted an attempt meanwhile
+            rows = self._make_request("GET", f"ticket?id=eq.{ticket_id}&select=resolution_attempts")
+            if not rows:
+                return []
+            attempts = rows[0].get('resolution_attempts')
+            guard = ("resolution_attempts", f"eq.{attempts}" if attempts is not None else "is.null")
+            row = self.transition_ticket(ticket_id, 'start_resolution', {
+                'date_mise_a_jour': datetime.now().isoformat(),
+                'resolution_due_at': due_at.isoformat(),
+                'resolution_attempts': (attempts or 0) + 1,
+            }, conditions + [guard])
+            return [row] if row else []
+        
+        try:
+            result = self._workflow_rpc("start_ticket_resolution", {
+                'ticket_id': ticket_id,
+                'from_status_ids': source_ids,
+                'to_status_id': target_id,
+                'due_at': due_at.isoformat(),
+                'habilitation_ids': sorted(habilitation_ids) if habilitation_ids is not None else None,
+            }, read_then_patch)
+        except Exception as e:
+            print(f"Error starting ticket resolution: {e}")
+            return None
+        if result:
+            self._invalidate_ticket_write(result)
+        return result[0] if result else None
+    
+    def refuse_ticket_resolution(self, ticket_id, owner_id, title_suffix, reassign_role_id):
+        """'refuse' transition by the ticket's owner: back to the start with title_suffix appended.
+        
+        Returns the updated row, or None if owner_id does not own the ticket
+        or it is not awaiting validation.
+        """
+        source_ids, target_id = self._transition_status_ids(workflow.get_transition('refuse'))
+        if not source_ids or not target_id:
+            print("Error refusing ticket resolution: status not found")
+            return None
+        
+        def read_then_patch():
+            # Optimistic: the PATCH only applies if the title is still the one read
+            rows = self._make_request("GET", f"ticket?id=eq.{ticket_id}&idutilisateur=eq.{owner_id}&select=titre")
+            if not rows:
+                return []
+            titre = rows[0].get('titre') or ''
+            row = self.transition_ticket(ticket_id, 'refuse', {
+                'titre': (titre + ' ' + title_suffix).strip(),
+                'resolution_due_at': None,
+                'required_habilitation_id': None,
+                'assigned_role_id': reassign_role_id,
+            }, [("idutilisateur", f"eq.{owner_id}"), ("titre", f"eq.{titre}")])
+            return [row] if row else []
+        
+        try:
+            result = self._workflow_rpc("refuse_ticket_resolution", {
+                'ticket_id': ticket_id,
+                'owner_id': owner_id,
+                'from_status_ids': source_ids,
+                'to_status_id': target_id,
+                'title_suffix': title_suffix,
+                'reassign_role_id': reassign_role_id,
+            }, read_then_patch)
+        except Exception as e:
+            print(f"Error refusing ticket resolution: {e}")
+            return None
+        if result:
+            self._invalidate_ticket_write(result)
+        return result[0] if result else None
+    
+    def bulk_update_tickets(self, ticket_ids, ticket_data, conditions=None):
+        """Apply the same update to many tickets with one PATCH per chunk of ids.
+        
+        conditions is an optional PostgREST filter string every row must also
+        match. Returns the ids of the tickets actually updated.
+        """
+        ids = sorted({int(ticket_id) for ticket_id in ticket_ids})
+        updated = []
+        for start in range(0, len(ids), self.bulk_chunk_size):
+            chunk = ids[start:start + self.bulk_chunk_size]
+            # Only ask for the columns needed to report and invalidate
+            query = f"ticket?id=in.({','.join(map(str, chunk))})&select=id,idutilisateur"
+            if conditions:
+                query += f"&{conditions}"
+            try:
+                updated.extend(self._make_request("PATCH", query, data=ticket_data))
+            except Exception as e:
+                print(f"Error bulk updating tickets {chunk[0]}..{chunk[-1]}: {e}")
+        
+        if updated:
+            self._invalidate_ticket_write(updated, ticket_data)
+        return [row['id'] for row in updated]
+    
     def update_ticket_status(self, ticket_id, status_id, additional_data=None):
         """Update ticket status and optionally other fields"""
         try:
@@ -430,119 +1320,244 @@ class SupabaseDB:
                 data.update(additional_data)
             
             result = self._make_request("PATCH", f"ticket?id=eq.{ticket_id}", data=data)
+            self._invalidate_ticket_write(result, data)
             return result[0] if result else None
         except Exception as e:
             print(f"Error updating ticket status: {e}")
             return None
     
+    def _ticket_filter_params(self, filters):
+        """PostgREST params for the ticket list filters (status, category, role, date_from, date_to)"""
+        params = []
+        for key, column in TICKET_FILTER_COLUMNS.items():
+            value = filters.get(key)
+            if value not in (None, ''):
+                params.append((column, f"eq.{int(value)}"))
+        
+        date_from = _parse_date(filters.get('date_from'))
+        if date_from:
+            params.append(("date_creation", f"gte.{date_from.isoformat()}"))
+        date_to = _parse_date(filters.get('date_to'))
+        if date_to:
+            # A bare date includes the whole day
+            if len(filters['date_to']) == 10:
+                params.append(("date_creation", f"lt.{(date_to + timedelta(days=1)).isoformat()}"))
+            else:
+                params.append(("date_creation", f"lte.{date_to.isoformat()}"))
+        return params
+    
+    def get_ticket_page(self, profile, scope=None, filters=None, page_size=None, after=None, before=None):
+        """Get one keyset page of tickets ordered by (date_creation, id) descending.
+        
+        profile names the projection in TICKET_PROJECTIONS. scope is an optional PostgREST logic-tree clause restricting which tickets
+        are visible (e.g. the caller's role). filters may contain status,
+        category, role, date_from and date_to. after/before are cursors from a
+        previous page; at most one should be given.
+        
+        Returns a dict with the page's tickets and the cursors of the next and
+        previous pages (None when there is no such page).
+        """
+        page_size = page_size or self.page_size
+        filters = filters or {}
+        after = decode_ticket_cursor(after)
+        before = None if after else decode_ticket_cursor(before)
+        
+        params = self._ticket_filter_params(filters)
+        clauses = [scope] if scope else []
+        
+        # Keyset condition: strictly after (or before) the cursor row
+        if after:
+            date_creation, ticket_id = after
+            clauses.append(f'or(date_creation.lt."{date_creation}",and(date_creation.eq."{date_creation}",id.lt.{ticket_id}))')
+        elif before:
+            date_creation, ticket_id = before
+            clauses.append(f'or(date_creation.gt."{date_creation}",and(date_creation.eq."{date_creation}",id.gt.{ticket_id}))')
+        if clauses:
+            params.append(("and", f"({','.join(clauses)})"))
+        
+        # Walking backwards reads ascending from the cursor, then flips the rows
+        direction = "asc" if before else "desc"
+        params.append(("order", f"date_creation.{direction},id.{direction}"))
+        params.append(("limit", str(page_size + 1)))
+        
+        rows = self._get_tickets(profile, params=params)
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if before:
+            rows.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, after is not None
+        
+        return {
+            'tickets': rows,
+            'next_cursor': encode_ticket_cursor(rows[-1]) if rows and has_next else None,
+            'prev_cursor': encode_ticket_cursor(rows[0]) if rows and has_prev else None
+        }
+    
+    def stream_ticket_page(self, profile, scope=None, filters=None, page_size=None, after=None, before=None):
+        """Like get_ticket_page, but returns a TicketPageStream that runs the query when first iterated"""
+        return TicketPageStream(lambda: self.get_ticket_page(
+            profile, scope=scope, filters=filters, page_size=page_size, after=after, before=before
+        ))
+    
     # Optimized dashboard methods
     def get_dashboard_data(self, user_id, user_role):
         """Get all dashboard data in optimized queries"""
-        try:
-            # Get user tickets with all related data in one query
-            tickets_query = f"ticket?idutilisateur=eq.{user_id}&select=id,titre,description,date_creation,statut_id,statut(nom),categorie_id,categorie(nom),type_id,type(nom),priorite_id,priorite(nom),assigned_role_id,required_habilitation_id,resolution_due_at,resolution_attempts&order=date_creation.desc"
-            
-            # Get all static data in parallel (these are cached)
-            tickets_data = self._make_request("GET", tickets_query)
-            statuses_data = self.get_all_statuses()
-            categories_data = self.get_all_categories()
-            types_data = self.get_all_types()
-            
-            return {
-                'tickets': tickets_data,
-                'statuses': statuses_data,
-                'categories': categories_data,
-                'types': types_data
-            }
-        except Exception as e:
-            print(f"Error getting dashboard data: {e}")
-            return {
-                'tickets': [],
-                'statuses': [],
-                'categories': [],
-                'types': []
-            }
-    
-    def get_admin_dashboard_data(self):
-        """Get all admin dashboard data in optimized queries"""
-        try:
-            # Get all tickets with user and status info in one query
-            tickets_query = "ticket?select=id,titre,description,date_creation,statut_id,statut(nom),idutilisateur,utilisateur(nom_utilisateur,prenom,nom),categorie_id,categorie(nom),type_id,type(nom),priorite_id,priorite(nom),assigned_role_id,required_habilitation_id,resolution_due_at,resolution_attempts&order=date_creation.desc"
-            
-            # Get all static data (cached)
-            tickets_data = self._make_request("GET", tickets_query)
-            statuses_data = self.get_all_statuses()
-            users_data = self.get_all_users()
-            categories_data = self.get_all_categories()
-            types_data = self.get_all_types()
-            
-            return {
-                'tickets': tickets_data,
-                'statuses': statuses_data,
-                'users': users_data,
-                'categories': categories_data,
-                'types': types_data
-            }
-        except Exception as e:
-            print(f"Error getting admin dashboard data: {e}")
-            return {
-                'tickets': [],
-                'statuses': [],
-                'users': [],
-                'categories': [],
-                'types': []
-            }
-    
-    def get_resolution_dashboard_data(self, role_id, role_name):
-        """Get resolution dashboard data optimized for role-based access"""
-        try:
-            if role_name == 'N1':
-                # N1 sees tickets assigned to N1 or unassigned
-                tickets_query = f"ticket?or=(assigned_role_id.eq.{role_id},assigned_role_id.is.null)&select=id,titre,description,date_creation,statut_id,statut(nom),idutilisateur,utilisateur(nom_utilisateur),categorie_id,categorie(nom),type_id,type(nom),priorite_id,priorite(nom),assigned_role_id,required_habilitation_id,resolution_due_at,resolution_attempts&order=date_creation.desc"
-            else:
-                # Others see only tickets assigned to their role
-                tickets_query = f"ticket?assigned_role_id=eq.{role_id}&select=id,titre,description,date_creation,statut_id,statut(nom),idutilisateur,utilisateur(nom_utilisateur),categorie_id,categorie(nom),type_id,type(nom),priorite_id,priorite(nom),assigned_role_id,required_habilitation_id,resolution_due_at,resolution_attempts&order=date_creation.desc"
-            
-            tickets_data = self._make_request("GET", tickets_query)
-            habilitations_data = self.get_all_habilitations()
-            
-            # Get role habilitations for permission checking
-            role_habilitations = self.get_role_habilitations(role_id) if role_id else []
-            role_hab_ids = {h['id'] for h in role_habilitations}
-            
-            return {
-                'tickets': tickets_data,
-                'habilitations': habilitations_data,
-                'role_hab_ids': role_hab_ids
-            }
-        except Exception as e:
-            print(f"Error getting resolution dashboard data: {e}")
-            return {
-                'tickets': [],
-                'habilitations': [],
-                'role_hab_ids': set()
-            }
-    
-    def invalidate_cache(self, pattern=None):
-        """Invalidate cache entries"""
-        self._clear_cache(pattern)
+        # Get user tickets with the list projection in one query
+        tickets_query = f"idutilisateur=eq.{user_id}&order=date_creation.desc"
+        
+        # Only the ticket query runs under the bundle deadline; the static
+        # data is read from the in-memory reference snapshot
+        data = self._fetch_bundle({
+            'tickets': lambda: self._cached(
+                f"dashboard_tickets_{user_id}",
+                lambda: self._get_tickets('list', tickets_query),
+                ttl=self._ticket_cache_duration,
+                tags=["tickets", f"tickets:user:{user_id}"]
+            ),
+        }, {'tickets': []}, label="dashboard data")
+        data['statuses'] = self.get_all_statuses()
+        data['categories'] = self.get_all_categories()
+        data['types'] = self.get_all_types()
+        return data
+    
+    def invalidate_cache(self, *tags):
+        """Invalidate cache entries depending on tags (e.g. "users",
+        "tickets:user:<id>"), or the whole cache when no tag is given"""
+        self._clear_cache(*tags)
+    
+    def get_cache_stats(self):
+        """Hit, miss and eviction counters of each cache backend"""
+        return self._cache.get_stats()
+    
+    def get_transport_stats(self):
+        """Connection pool hit/miss and retry counters"""
+        return self.transport.get_stats()
     
     def preload_static_data(self):
         """Preload all static data to warm up the cache"""
         try:
-            # Load all static data that's commonly used
-            self.get_all_statuses()
-            self.get_all_categories()
-            self.get_all_types()
-            self.get_all_habilitations()
-            self.get_all_roles()
+            # Load all reference tables in one warm-up, then permissions and the user list
+            self._load_reference_data()
+            self._load_permission_matrix()
             self.get_all_users()
             print("Static data preloaded successfully")
         except Exception as e:
             print(f"Error preloading static data: {e}")
+        finally:
+            # Requests stop serving the boot snapshot, even if Supabase was unreachable
+            self._warmed_up.set()
+    
+    def start_warmup(self):
+        """Run preload_static_data in a background thread"""
+        thread = threading.Thread(target=self.preload_static_data, daemon=True, name="supabase-warmup")
+        thread.start()
+        return thread
+    
+    # Reference-data snapshot file
+    def load_snapshot(self):
+        """Install the reference data saved by a previous process.
+        
+        Returns True when a snapshot of this Supabase project was loaded; a
+        missing, unreadable or older-format file is ignored, and so is a file
+        another user owns or could have written.
+        """
+        if not self.snapshot_path:
+            return False
+        try:
+            fd = os.open(self.snapshot_path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Error reading reference snapshot: {e}")
+            return False
+        try:
+            st = os.fstat(fd)
+            if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+                print(f"Ignoring reference snapshot {self.snapshot_path}: not owned and writable by this user only")
+                return False
+            with os.fdopen(fd, encoding="utf-8") as f:
+                fd = None
+                snapshot = json.load(f)
+        except Exception as e:
+            print(f"Error reading reference snapshot: {e}")
+            return False
+        finally:
+            if fd is not None:
+                os.close(fd)
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("supabase_url") != self.supabase_url:
+            return False
+        
+        tables = snapshot["reference"]
+        self._persisted = tables
+        self._reference = ReferenceData(tables, version=self._reference.version + 1)
+        return True
+    
+    def save_snapshot(self):
+        """Write the current reference data to the snapshot file if it changed"""
+        tables = self._reference.source
+        if not self.snapshot_path or not tables or self._persisted == tables:
+            return False
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "saved_at": datetime.now().isoformat(),
+            "supabase_url": self.supabase_url,
+            "reference": tables,
+        }
+        # Replace the file atomically, so another process never reads a partial snapshot
+        directory, name = os.path.split(os.path.abspath(self.snapshot_path))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            print(f"Error writing reference snapshot: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self._persisted = tables
+        return True
+
+def create_db():
+    """Build the SupabaseDB instance: serve the snapshot file at once and revalidate it in the background"""
+    instance = SupabaseDB()
+    instance.load_snapshot()
+    instance.start_warmup()
+    return instance
+
+
+class LazySupabaseDB:
+    """Stand-in for the global SupabaseDB, built by factory on first attribute access"""
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+    
+    def _after_fork(self):
+        """A forked child builds its own instance: the parent's executor
+        threads, pooled connections and locks do not survive the fork"""
+        self._lock = threading.Lock()
+        self._instance = None
+    
+    def get(self):
+        """The underlying instance, building it on first call"""
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+                instance = self._instance
+        return instance
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
 
-# Global database instance
-db = SupabaseDB()
 
-# Preload static data on startup
-db.preload_static_data()
+# Global database instance, built on first use so importing the module makes no request
+db = LazySupabaseDB(create_db)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Tracing Module
+Span trees of the backend calls made by each request (route -> SupabaseDB
+method -> HTTP call), with detection of wasteful call patterns
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import os
+import threading
+import time
+from collections import Counter, deque
+
+# Tracing is off unless TRACE_REQUESTS=1; the last TRACE_BUFFER traces are kept
+TRACE_ENABLED = os.environ.get('TRACE_REQUESTS', '0') == '1'
+TRACE_BUFFER = int(os.environ.get('TRACE_BUFFER', 50))
+# Calls to one endpoint from one parent span, with different queries, flagged as N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('TRACE_N_PLUS_ONE', 3))
+
+_trace_ids = itertools.count(1)
+_current_trace = contextvars.ContextVar('trace', default=None)
+_current_span = contextvars.ContextVar('span', default=None)
+_traces = deque(maxlen=TRACE_BUFFER)
+_traces_lock = threading.Lock()
+
+
+class Span:
+    """One timed step of a trace; kind is 'route', 'db' or 'http'"""
+
+    __slots__ = ('id', 'name', 'kind', 'parent', 'start', 'end', 'thread', 'attrs', 'children')
+
+    def __init__(self, span_id, name, kind, parent, attrs):
+        self.id = span_id
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread = threading.get_ident()
+        self.attrs = attrs
+        self.children = []
+
+    def walk(self):
+        """This span and all its descendants"""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def has_http(self):
+        return any(s.kind == 'http' for s in self.walk())
+
+
+class Trace:
+    """Span tree of one request"""
+
+    def __init__(self, name, attrs):
+        self.id = next(_trace_ids)
+        self._span_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.created = time.time()
+        self.root = Span(0, name, 'route', None, attrs)
+        self.findings = []
+
+    def start_span(self, name, kind, parent, attrs):
+        span = Span(next(self._span_ids), name, kind, parent, attrs)
+        # Fan-out threads add children concurrently
+        with self._lock:
+            (parent or self.root).children.append(span)
+        return span
+
+    def analyze(self):
+        """Flag repeated identical calls, N+1 patterns and sequential independent calls"""
+        findings = []
+        spans = list(self.root.walk())
+        http = [s for s in spans if s.kind == 'http']
+
+        for signature, count in Counter(s.attrs['signature'] for s in http).items():
+            if count > 1:
+                findings.append({'type': 'repeated_call', 'call': signature, 'count': count})
+
+        # One method querying the same endpoint for many different rows
+        groups = {}
+        for s in http:
+            key = ((s.parent.name if s.parent else self.root.name), s.attrs['method'], s.attrs['endpoint'])
+            groups.setdefault(key, set()).add(s.attrs['signature'])
+        for (caller, method, endpoint), signatures in groups.items():
+            if len(signatures) >= N_PLUS_ONE_THRESHOLD:
+                findings.append({'type': 'n_plus_one', 'call': f"{method} {endpoint}",
+                                 'count': len(signatures), 'caller': caller})
+
+        # Top-level SupabaseDB calls that reached the backend one after another
+        # could run concurrently if they do not depend on each other
+        runs, current = [], []
+        for s in sorted((c for c in self.root.children if c.kind == 'db' and c.has_http()), key=lambda c: c.start):
+            if current and s.start < current[-1].end:
+                if len(current) >= 2:
+                    runs.append(current)
+                current = [s]
+            else:
+                current.append(s)
+        if len(current) >= 2:
+            runs.append(current)
+        for run in runs:
+            durations = [(s.end - s.start) * 1000 for s in run]
+            findings.append({'type': 'sequential_calls', 'calls': [s.name for s in run],
+                             'total_ms': round(sum(durations), 1),
+                             'saving_ms': round(sum(durations) - max(durations), 1)})
+
+        self.findings = findings
+        return findings
+
+    def to_dict(self):
+        """Span tree and findings as JSON-serializable data"""
+        origin = self.root.start
+
+        def span_dict(span):
+            end = span.end if span.end is not None else time.perf_counter()
+            return {
+                'name': span.name,
+                'kind': span.kind,
+                'start_ms': round((span.start - origin) * 1000, 3),
+                'duration_ms': round((end - span.start) * 1000, 3),
+                'thread': span.thread,
+                'attrs': span.attrs,
+                'children': [span_dict(c) for c in span.children],
+            }
+
+        return {'id': self.id, 'created': self.created, 'findings': self.findings, 'root': span_dict(self.root)}
+
+    def to_chrome(self):
+        """Chrome trace event format (chrome://tracing, Perfetto)"""
+        origin = self.root.start
+        events = []
+        for span in self.root.walk():
+            end = span.end if span.end is not None else time.perf_counter()
+            events.append({
+                'name': span.name,
+                'cat': span.kind,
+                'ph': 'X',
+                'ts': round((span.start - origin) * 1e6, 1),
+                'dur': round((end - span.start) * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': span.thread,
+                'args': span.attrs,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'findings': self.findings}}
+
+    def summary(self):
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return {
+            'id': self.id,
+            'created': self.created,
+            'route': self.root.name,
+            'duration_ms': round((end - self.root.start) * 1000, 1),
+            'http_calls': sum(1 for s in self.root.walk() if s.kind == 'http'),
+            'findings': len(self.findings),
+        }
+
+
+def is_active():
+    """Whether the current request is being traced"""
+    return _current_trace.get() is not None
+
+
+def begin_trace(name, **attrs):
+    """Start tracing the current request; None when tracing is off"""
+    if not TRACE_ENABLED:
+        return None
+    trace = Trace(name, attrs)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def end_trace():
+    """Finish the current trace, analyze it and keep it in the buffer"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    _current_span.set(None)
+    trace.root.end = time.perf_counter()
+    findings = trace.analyze()
+    with _traces_lock:
+        _traces.append(trace)
+    for finding in findings:
+        print(f"trace {trace.id} {trace.root.name}: {finding}")
+    return trace
+
+
+@contextlib.contextmanager
+def span(name, kind, **attrs):
+    """Time a block as a child of the current span; no-op outside a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, kind, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced_methods(cls):
+    """Class decorator recording a 'db' span for every public method call"""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith('_') or not inspect.isfunction(value):
+            continue
+        setattr(cls, attr, _traced(value))
+    return cls
+
+
+def _traced(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current_trace.get() is None:
+            return fn(*args, **kwargs)
+        with span(fn.__name__, 'db'):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def recent_traces():
+    """Summaries of the buffered traces, newest first"""
+    with _traces_lock:
+        traces = list(_traces)
+    return [t.summary() for t in reversed(traces)]
+
+
+def get_trace(trace_id):
+    """Buffered trace with id trace_id, or None"""
+    with _traces_lock:
+        return next((t for t in _traces if t.id == trace_id), None)
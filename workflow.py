@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Ticket Workflow Module
+Ticket state machine: the statuses a ticket goes through and the transitions
+allowed between them
+"""
+
+# Ticket statuses, by name in the statut table
+DECLARED = 'Incident déclaré'
+TAKEN_OVER = 'Incident pris en charge'
+IN_RESOLUTION = 'Incident en cours de résolution'
+RESOLVED = 'Incident résolu'
+CLOSED = 'Incident clos'
+
+
+class Transition:
+    """A named move of a ticket to target from one of the sources statuses"""
+
+    __slots__ = ('name', 'sources', 'target')
+
+    def __init__(self, name, sources, target):
+        self.name = name
+        self.sources = tuple(sources)
+        self.target = target
+
+    def __repr__(self):
+        return f"Transition({self.name!r}, {self.sources!r} -> {self.target!r})"
+
+
+# declared -> taken over -> in resolution -> resolved -> closed, plus
+# escalation to the next support level and refusal of a resolution by the
+# requester, which sends the ticket back to the start
+TRANSITIONS = {t.name: t for t in (
+    Transition('qualify', (DECLARED,), TAKEN_OVER),
+    Transition('escalate', (DECLARED, TAKEN_OVER), TAKEN_OVER),
+    Transition('start_resolution', (DECLARED, TAKEN_OVER), IN_RESOLUTION),
+    Transition('resolve', (IN_RESOLUTION,), RESOLVED),
+    Transition('close', (RESOLVED,), CLOSED),
+    Transition('refuse', (RESOLVED,), DECLARED),
+)}
+
+
+def get_transition(name):
+    """Transition called name; ValueError for an unknown one"""
+    try:
+        return TRANSITIONS[name]
+    except KeyError:
+        raise ValueError(f"Unknown ticket transition: {name}") from None
+
+
+def allowed_transitions(status):
+    """Names of the transitions a ticket in status can take"""
+    return [t.name for t in TRANSITIONS.values() if status in t.sources]